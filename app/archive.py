@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import time
+
+from app import db, sql
+
+class TicketArchiver:
+    """
+    Фоновый перенос давно завершенных тикетов в ticket_archive.
+    Тикеты переносятся небольшими пачками, каждая в своей транзакции, с паузой между пачками,
+    поэтому запись в базу от обработчиков бота не ждет окончания всего переноса.
+    Чтение истории, карточек тикетов, поиска и выгрузки идет по обеим таблицам.
+    """
+
+    def __init__(self, max_age: int, batch_size: int = 500, interval: float = 3600.0, pause: float = 0.1) -> None:
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+
+    async def run(self) -> None:
+        """Переносит тикеты раз в interval секунд, пока задача не будет отменена."""
+        while True:
+            try:
+                moved = await self.archive_once()
+                if moved:
+                    logging.info("В архив перенесено тикетов: %s", moved)
+            except Exception:
+                logging.exception("Ошибка переноса тикетов в архив")
+            await asyncio.sleep(self.interval)
+
+    async def archive_once(self) -> int:
+        """Переносит все тикеты старше max_age пачками и возвращает их число."""
+        closed_before = int(time.time()) - self.max_age
+        # Накопительные таблицы отчетов дописываются по таблице ticket, поэтому их нужно
+        # обновить до того, как тикеты из нее уйдут. При первом запуске это заполнение по всей
+        # истории тикетов: оно идет порциями с той же паузой, что и перенос
+        await db.refresh_report_rollups(closed_before, max(self.pause, sql.REPORT_CHUNK_PAUSE))
+        total = 0
+        while True:
+            moved = await db.archive_closed_tickets(closed_before, self.batch_size)
+            total += moved
+            if moved < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+def archive_now(max_age: int, batch_size: int = 500, pause: float = 0.0) -> int:
+    """Синхронный вариант archive_once для служебных команд: переносит тикеты старше max_age секунд."""
+    closed_before = int(time.time()) - max_age
+    while not sql.refresh_report_rollups(closed_before):
+        time.sleep(max(pause, sql.REPORT_CHUNK_PAUSE))
+    total = 0
+    while True:
+        moved = sql.archive_closed_tickets(closed_before, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        time.sleep(pause)
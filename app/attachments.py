@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import uuid
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from app import db, sql
+
+# Bot API отдает через getFile только файлы до 20 МБ
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+
+def from_message(message: Message) -> list[sql.Attachment]:
+    """Возвращает вложения сообщения: фото (в наибольшем размере) или документ."""
+    attachments = []
+    if message.photo:
+        photo = message.photo[-1]
+        attachments.append(('photo', photo.file_id, photo.file_unique_id, None, 'image/jpeg', photo.file_size))
+    if message.document:
+        document = message.document
+        attachments.append(('document', document.file_id, document.file_unique_id, document.file_name,
+                            document.mime_type, document.file_size))
+    return attachments
+
+class AttachmentStore:
+    """
+    Локальное хранилище вложений с адресацией по file_unique_id: одинаковое содержимое хранится один раз.
+    Файлы скачиваются в фоне после создания тикета, поэтому ответ пользователю не ждет загрузки.
+    Загрузка идет по частям прямо в файл, расход памяти не зависит от размера вложения.
+    """
+
+    def __init__(self, bot: Bot, directory: str, batch_size: int = 20, interval: float = 60.0,
+                 chunk_size: int = 64 * 1024) -> None:
+        self.bot = bot
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self._wakeup = asyncio.Event()
+
+    def path_for(self, file_unique_id: str) -> str:
+        # Первые два символа — подкаталог, чтобы в одном каталоге не копились тысячи файлов
+        return os.path.join(self.directory, file_unique_id[:2], file_unique_id)
+
+    def wake(self) -> None:
+        """Запускает загрузку новых вложений, не дожидаясь очередного интервала."""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Скачивает вложения, которых еще нет в хранилище, пока задача не будет отменена."""
+        while True:
+            try:
+                stored = await self.store_pending()
+            except Exception:
+                logging.exception("Ошибка загрузки вложений")
+                stored = 0
+            if stored < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def store_pending(self) -> int:
+        """Скачивает одну пачку вложений и возвращает число обработанных."""
+        rows = await db.get_unstored_attachments(self.batch_size)
+        for attachment_id, file_id, file_unique_id, file_size in rows:
+            if file_size and file_size > MAX_DOWNLOAD_SIZE:
+                await db.set_attachment_error(attachment_id, "Файл больше лимита загрузки Bot API")
+                continue
+            try:
+                path = await self.fetch(file_id, file_unique_id)
+            except TelegramBadRequest as error:
+                logging.warning("Вложение %s не скачано: %s", attachment_id, error)
+                await db.set_attachment_error(attachment_id, str(error))
+                continue
+            await db.set_attachment_stored(file_unique_id, path)
+        return len(rows)
+
+    async def fetch(self, file_id: str, file_unique_id: str) -> str:
+        """Возвращает путь к файлу в хранилище, скачивая его, только если такого содержимого еще нет."""
+        path = self.path_for(file_unique_id)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            await self.bot.download(file_id, destination=temp_path, chunk_size=self.chunk_size, timeout=120)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
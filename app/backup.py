@@ -0,0 +1,165 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from app import sql
+
+SUFFIX = '.db.gz'
+# Сколько раз копирование по шагам может начаться заново из-за записи в базу, прежде чем
+# оставшиеся страницы будут скопированы за один шаг (в режиме WAL это не блокирует запись)
+MAX_RESTARTS = 3
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+class _Restarted(Exception):
+    pass
+
+def _check(path: str) -> None:
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    if result != [('ok',)]:
+        raise sqlite3.DatabaseError(f"Копия {path} повреждена: {result[:5]}")
+
+def _checkpoint(path: str) -> None:
+    """По возможности переносит журнал WAL в основной файл базы, чтобы сохраненная копия была одним файлом."""
+    with open(path, 'rb') as file:
+        if file.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+            logging.warning("%s не является базой SQLite, журнал WAL оставлен рядом", path)
+            return
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.DatabaseError as error:
+        logging.warning("Не удалось перенести журнал WAL в %s: %s", path, error)
+    finally:
+        conn.close()
+
+def _copy(source: sqlite3.Connection, target_path: str, step_pages: int, pause: float) -> int:
+    """Копирует базу онлайн-API резервного копирования SQLite и возвращает число страниц."""
+    state = {'remaining': None, 'restarts': 0, 'total': 0}
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        # Запись в базу другим соединением начинает копирование заново: оставшихся страниц становится больше
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'], state['total'] = remaining, total
+        # Пауза между шагами освобождает базу для обработчиков бота
+        time.sleep(pause)
+
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=step_pages, progress=progress)
+        except _Restarted:
+            logging.info("База часто меняется во время копирования, оставшиеся страницы копируются за один шаг")
+            source.backup(target, pages=-1)
+            state['total'] = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+    return state['total']
+
+def list_backups(directory: str) -> list[str]:
+    """Возвращает пути к снимкам в каталоге, от старых к новым."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(SUFFIX)]
+
+def create_backup(directory: str, keep: int = 7, step_pages: int = 256, pause: float = 0.01) -> str:
+    """
+    Делает снимок базы без остановки бота: копирует ее по step_pages страниц с паузой pause между шагами,
+    проверяет копию (PRAGMA integrity_check), сжимает gzip и оставляет keep последних снимков.
+    Функция синхронная: из бота ее вызывают в отдельном потоке. Возвращает путь к снимку.
+    """
+    os.makedirs(directory, exist_ok=True)
+    started = time.monotonic()
+    name = time.strftime('database-%Y%m%d-%H%M%S')
+    raw_path = os.path.join(directory, f"{name}.db.tmp")
+    gz_path = os.path.join(directory, f"{name}{SUFFIX}")
+    source = sqlite3.connect(sql.DB_PATH)
+    try:
+        source.execute("PRAGMA busy_timeout = 5000")
+        pages = _copy(source, raw_path, step_pages, pause)
+        _check(raw_path)
+        with open(raw_path, 'rb') as raw, gzip.open(f"{gz_path}.tmp", 'wb', compresslevel=6) as compressed:
+            shutil.copyfileobj(raw, compressed, 1024 * 1024)
+        os.replace(f"{gz_path}.tmp", gz_path)
+        raw_size = os.path.getsize(raw_path)
+    finally:
+        source.close()
+        for path in (raw_path, f"{gz_path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+    logging.info("Резервная копия %s: %s страниц, %.1f МБ -> %.1f МБ, %.1f с", gz_path, pages,
+                 raw_size / 1048576, os.path.getsize(gz_path) / 1048576, time.monotonic() - started)
+    for old in list_backups(directory)[:-keep] if keep > 0 else []:
+        os.remove(old)
+        logging.info("Удалена старая резервная копия %s", old)
+    return gz_path
+
+def restore_backup(path: str, db_path: str | None = None) -> str:
+    """
+    Восстанавливает базу из снимка .db.gz. Бот должен быть остановлен.
+    Снимок распаковывается и проверяется до замены; текущая база вместе с файлами -wal и -shm
+    сохраняется рядом с суффиксом .before-restore, даже если она повреждена.
+    Возвращает путь к сохраненной базе (или пустую строку, если базы не было).
+    """
+    db_path = db_path or sql.DB_PATH
+    temp_path = f"{db_path}.restore"
+    try:
+        with gzip.open(path, 'rb') as compressed, open(temp_path, 'wb') as raw:
+            shutil.copyfileobj(compressed, raw, 1024 * 1024)
+        _check(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    saved = ""
+    if os.path.exists(db_path):
+        # Прежняя база переносится вместе с журналом: открывать ее до переноса нельзя — при закрытии
+        # соединения SQLite удаляет файл -wal, даже если сама база повреждена и журнал не перенесен
+        saved = f"{db_path}.before-restore-{time.strftime('%Y%m%d-%H%M%S')}"
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.replace(db_path + suffix, saved + suffix)
+        _checkpoint(saved)
+    # Журнал без базы к восстановленной базе применять нельзя
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(temp_path, db_path)
+    return saved
+
+class BackupJob:
+    """Фоновое резервное копирование базы раз в interval секунд в отдельном потоке."""
+
+    def __init__(self, directory: str, interval: float, keep: int = 7, step_pages: int = 256, pause: float = 0.01) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.step_pages = step_pages
+        self.pause = pause
+
+    def _seconds_until_due(self) -> float:
+        # После перезапуска бота отсчет идет от последнего снимка, а не от момента запуска
+        backups = list_backups(self.directory)
+        if not backups:
+            return 0.0
+        return max(0.0, os.path.getmtime(backups[-1]) + self.interval - time.time())
+
+    async def run(self) -> None:
+        """Делает снимки по расписанию, пока задача не будет отменена."""
+        while True:
+            await asyncio.sleep(self._seconds_until_due())
+            try:
+                await asyncio.to_thread(create_backup, self.directory, self.keep, self.step_pages, self.pause)
+            except Exception:
+                logging.exception("Ошибка резервного копирования")
+                await asyncio.sleep(min(self.interval, 600))
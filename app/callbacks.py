@@ -0,0 +1,109 @@
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery
+
+# Кнопки с параметрами. Разделитель ":" не встречается в простых действиях (my_company, admin_panel
+# и т.п.), поэтому действие определяется по тексту до первого ":" одним поиском в словаре.
+
+class TicketCallback(CallbackData, prefix='ticket'):
+    """Карточка тикета для администратора."""
+    id: int
+
+class CompleteCallback(CallbackData, prefix='complete'):
+    """Завершение тикета администратором."""
+    id: int
+
+class HistoryPageCallback(CallbackData, prefix='my_ticket_page'):
+    """Страница истории завершенных заявок: номер и граничный номер тикета (after или before)."""
+    page: int
+    after: Optional[int] = None
+    before: Optional[int] = None
+
+class AdminPageCallback(CallbackData, prefix='admin_page'):
+    """Страница открытых заявок в тикет-меню."""
+    page: int
+    after: Optional[int] = None
+    before: Optional[int] = None
+
+class AdminOrgCallback(CallbackData, prefix='admin_org'):
+    """Выбор организации в фильтре тикет-меню: индекс в показанном списке, None — все организации."""
+    index: Optional[int] = None
+
+class SearchPageCallback(CallbackData, prefix='search_page'):
+    """Страница результатов /search."""
+    page: int
+
+# Кнопки старого формата остаются в уже отправленных сообщениях (уведомления администраторам, outbox):
+# префикс -> новое значение callback_data. Тикеты переводятся в новый формат, страницы — на первую страницу.
+LEGACY_PREFIXES = {
+    'ticket_': lambda rest: TicketCallback(id=int(rest)).pack(),
+    'complete_': lambda rest: CompleteCallback(id=int(rest)).pack(),
+    'my_ticket_page_': lambda rest: 'my_ticket_history',
+    'admin_page_': lambda rest: 'admin_panel',
+    'admin_org_': lambda rest: 'admin_filter',
+    'search_page_': lambda rest: SearchPageCallback(page=1).pack(),
+}
+
+Handler = Callable[..., Awaitable[Any]]
+
+class CallbackRouter:
+    """
+    Таблица обработчиков нажатий на кнопки: действие -> (класс callback_data или None, обработчик).
+    Поиск обработчика — одно обращение к словарю, поэтому время разбора не растет с числом экранов.
+    Обработчик простого действия вызывается как handler(query, state),
+    обработчик кнопки с параметрами — как handler(query, state, callback_data).
+    """
+
+    def __init__(self) -> None:
+        self._routes: dict[str, tuple[type[CallbackData] | None, Handler]] = {}
+
+    def _add(self, action: str, factory: type[CallbackData] | None, handler: Handler) -> Handler:
+        if action in self._routes:
+            raise ValueError(f"Действие {action!r} уже зарегистрировано")
+        self._routes[action] = (factory, handler)
+        return handler
+
+    def action(self, name: str) -> Callable[[Handler], Handler]:
+        """Регистрирует обработчик кнопки без параметров (callback_data == name)."""
+        return lambda handler: self._add(name, None, handler)
+
+    def callback(self, factory: type[CallbackData]) -> Callable[[Handler], Handler]:
+        """Регистрирует обработчик кнопок с данными factory (callback_data == factory(...).pack())."""
+        return lambda handler: self._add(factory.__prefix__, factory, handler)
+
+    def resolve(self, data: str) -> tuple[Handler, CallbackData | None] | None:
+        """Возвращает обработчик и разобранные данные кнопки или None, если кнопка неизвестна."""
+        action, separator, _ = data.partition(':')
+        route = self._routes.get(action)
+        if route is None and not separator:
+            for prefix, convert in LEGACY_PREFIXES.items():
+                if data.startswith(prefix):
+                    try:
+                        return self.resolve(convert(data[len(prefix):]))
+                    except ValueError:
+                        return None
+            return None
+        if route is None:
+            return None
+        factory, handler = route
+        if factory is None:
+            return (handler, None) if not separator else None
+        try:
+            return handler, factory.unpack(data)
+        except (TypeError, ValueError):
+            return None
+
+    async def dispatch(self, query: CallbackQuery, state: FSMContext) -> None:
+        resolved = self.resolve(query.data or '')
+        if resolved is None:
+            logging.warning("Неизвестная кнопка: %r", query.data)
+            await query.answer()
+            return
+        handler, callback_data = resolved
+        if callback_data is None:
+            await handler(query, state)
+        else:
+            await handler(query, state, callback_data)
@@ -0,0 +1,189 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+from app import sql
+import config
+
+# Пул потоков, в котором выполняются все обращения к SQLite.
+# Обработчики бота не блокируют цикл событий на время запросов к диску.
+_executor: ThreadPoolExecutor | None = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=config.DB_WORKERS, thread_name_prefix="sqlite")
+    return _executor
+
+async def run(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Выполняет синхронную функцию из app.sql в пуле потоков базы данных и возвращает результат."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+async def close() -> None:
+    """Дожидается завершения начатых запросов, останавливает пул потоков и закрывает соединения."""
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+    sql.close_connections()
+
+async def add_user(tg_id: int, data_reg: str, organization: str, organization_adress: str,
+                   organization_inn: str, organization_phone: str, history_ticket: str = "",
+                   data_ticket: str = "", user_name: str = "") -> None:
+    """Добавляет нового пользователя в базу данных."""
+    await run(sql.add_user, tg_id, data_reg, organization, organization_adress,
+              organization_inn, organization_phone, history_ticket, data_ticket, user_name)
+
+async def get_user_by_id(tg_id: int) -> dict | None:
+    """Возвращает информацию о пользователе по Telegram ID."""
+    return await run(sql.get_user_by_id, tg_id)
+
+async def update_user_field(tg_id: int, field_name: str, value: str) -> None:
+    """Обновляет указанное поле пользователя."""
+    await run(sql.update_user_field, tg_id, field_name, value)
+
+async def add_ticket(tg_id_ticket: int, organization: str, addres_ticket: str, message_ticket: str,
+                     time_ticket: str, state_ticket: str, ticket_comm: str) -> None:
+    """Добавляет новый тикет в базу данных."""
+    await run(sql.add_ticket, tg_id_ticket, organization, addres_ticket, message_ticket,
+              time_ticket, state_ticket, ticket_comm)
+
+async def create_ticket(tg_id_ticket: int, organization: str, addres_ticket: str, message_ticket: str,
+                        time_ticket: str, user_name: str | None, state_ticket: str = "В работе",
+                        ticket_comm: str = "",
+                        notifications: Callable[[int], Iterable[sql.Notification]] | None = None,
+                        attachments: Iterable[sql.Attachment] = ()) -> int:
+    """Создает тикет с вложениями, обновляет профиль пользователя и ставит уведомления в outbox одной транзакцией."""
+    return await run(sql.create_ticket, tg_id_ticket, organization, addres_ticket, message_ticket,
+                     time_ticket, user_name, state_ticket, ticket_comm, notifications, list(attachments))
+
+async def get_last_ticket_number() -> int:
+    """Возвращает номер последнего тикета."""
+    return await run(sql.get_last_ticket_number)
+
+async def get_ticket_count(tg_id: int | None, status: str) -> int:
+    """Возвращает количество тикетов с указанным статусом. Если tg_id=None — для всех пользователей."""
+    return await run(sql.get_ticket_count, tg_id, status)
+
+async def get_ticket_status_totals(tg_id: int | None = None) -> dict[str, int]:
+    """Возвращает количество тикетов по каждому статусу одним запросом. Если tg_id=None — для всех пользователей."""
+    return await run(sql.get_ticket_status_totals, tg_id)
+
+async def get_tickets_in_progress_by_user_id(tg_id: int) -> list[tuple]:
+    """Возвращает список тикетов пользователя в статусе "В работе"."""
+    return await run(sql.get_tickets_in_progress_by_user_id, tg_id)
+
+async def get_all_tickets_in_progress() -> list[tuple]:
+    """Возвращает список всех тикетов в статусе "В работе"."""
+    return await run(sql.get_all_tickets_in_progress)
+
+async def get_ticket_info(ticket_id: int) -> tuple | None:
+    """Возвращает информацию о тикете по его номеру."""
+    return await run(sql.get_ticket_info, ticket_id)
+
+async def get_completed_tickets_by_user(tg_id: int) -> list[tuple]:
+    """Возвращает список завершенных тикетов пользователя."""
+    return await run(sql.get_completed_tickets_by_user, tg_id)
+
+async def refresh_report_rollups(closed_until: int, pause: float = sql.REPORT_CHUNK_PAUSE) -> None:
+    """Дописывает в накопительные таблицы отчетов тикеты, появившиеся с прошлого обновления, порциями с паузой pause."""
+    while not await run(sql.refresh_report_rollups, closed_until):
+        await asyncio.sleep(pause)
+
+async def get_created_daily(since_day: str) -> list[tuple[str, str, int]]:
+    """Возвращает число созданных тикетов по дням и организациям начиная с даты since_day."""
+    return await run(sql.get_created_daily, since_day)
+
+async def get_resolution_histogram(since_day: str) -> list[tuple[int, int]]:
+    """Возвращает гистограмму времени выполнения тикетов, закрытых с даты since_day."""
+    return await run(sql.get_resolution_histogram, since_day)
+
+async def get_open_backlog_ages(now: int, bounds: Iterable[int]) -> list[int]:
+    """Возвращает число тикетов в работе по возрастным интервалам с границами bounds."""
+    return await run(sql.get_open_backlog_ages, now, list(bounds))
+
+async def get_completed_tickets_page(tg_id: int, after: int | None = None, before: int | None = None,
+                                     limit: int = 4) -> tuple[list[tuple], bool, bool]:
+    """Возвращает страницу завершенных тикетов пользователя и признаки наличия предыдущей и следующей страниц."""
+    return await run(sql.get_completed_tickets_page, tg_id, after, before, limit)
+
+async def get_open_tickets_page(organization: str | None = None, after: int | None = None, before: int | None = None,
+                                limit: int = 8, newest_first: bool = False) -> tuple[list[tuple], bool, bool]:
+    """Возвращает страницу тикетов в статусе "В работе" и признаки наличия предыдущей и следующей страниц."""
+    return await run(sql.get_open_tickets_page, organization, after, before, limit, newest_first)
+
+async def get_open_ticket_organizations(limit: int = 20) -> list[tuple[str, int]]:
+    """Возвращает организации с открытыми тикетами и количество их тикетов."""
+    return await run(sql.get_open_ticket_organizations, limit)
+
+async def search_tickets(text: str, offset: int = 0, limit: int = 5) -> tuple[list[tuple], bool]:
+    """Ищет тикеты по тексту и возвращает страницу результатов и признак наличия следующей страницы."""
+    return await run(sql.search_tickets, text, offset, limit)
+
+async def update_ticket_comment(ticket_id: int, ticket_comm: str) -> bool:
+    """Обновляет комментарий существующего тикета."""
+    return await run(sql.update_ticket_comment, ticket_id, ticket_comm)
+
+async def read_ticket_comment(ticket_id: int) -> str | None:
+    """Читает комментарий существующего тикета."""
+    return await run(sql.read_ticket_comment, ticket_id)
+
+async def get_pending_notifications(limit: int = 50) -> list[tuple[int, str, dict, int]]:
+    """Возвращает готовые к отправке уведомления из outbox."""
+    return await run(sql.get_pending_notifications, limit)
+
+async def mark_notifications_sent(ids: Iterable[int]) -> None:
+    """Отмечает уведомления доставленными."""
+    await run(sql.mark_notifications_sent, list(ids))
+
+async def reschedule_notification(notification_id: int, delay: int, error: str) -> None:
+    """Откладывает повторную отправку уведомления."""
+    await run(sql.reschedule_notification, notification_id, delay, error)
+
+async def mark_notification_failed(notification_id: int, error: str) -> None:
+    """Отмечает уведомление как неотправляемое."""
+    await run(sql.mark_notification_failed, notification_id, error)
+
+async def purge_sent_notifications(older_than: int) -> None:
+    """Удаляет старые доставленные уведомления."""
+    await run(sql.purge_sent_notifications, older_than)
+
+async def get_fsm_record(key: str) -> tuple[str | None, dict] | None:
+    """Возвращает состояние FSM и его данные по ключу хранилища."""
+    return await run(sql.get_fsm_record, key)
+
+async def save_fsm_records(records: Iterable[tuple[str, str | None, dict]]) -> None:
+    """Сохраняет пачку записей FSM одной транзакцией."""
+    await run(sql.save_fsm_records, list(records))
+
+async def transition_tickets(ticket_ids: Iterable[int], from_state: str, to_state: str, event: str,
+                             actor: int | None = None,
+                             notifications: Callable[[list[tuple]], Iterable[sql.Notification]] | None = None) -> list[tuple]:
+    """Меняет статус тикетов одним запросом с записью в журнал событий и outbox."""
+    return await run(sql.transition_tickets, list(ticket_ids), from_state, to_state, event, actor, notifications)
+
+async def get_ticket_events(ticket_id: int) -> list[tuple]:
+    """Возвращает историю смены статусов тикета."""
+    return await run(sql.get_ticket_events, ticket_id)
+
+async def archive_closed_tickets(closed_before: int, limit: int = 500) -> int:
+    """Переносит пачку давно завершенных тикетов в архив и возвращает их число."""
+    return await run(sql.archive_closed_tickets, closed_before, limit)
+
+async def get_ticket_attachments(ticket_id: int) -> list[tuple]:
+    """Возвращает вложения тикета."""
+    return await run(sql.get_ticket_attachments, ticket_id)
+
+async def get_unstored_attachments(limit: int = 20) -> list[tuple]:
+    """Возвращает вложения, которые еще не скачаны в хранилище."""
+    return await run(sql.get_unstored_attachments, limit)
+
+async def set_attachment_stored(file_unique_id: str, stored_path: str) -> None:
+    """Записывает путь к скачанному файлу."""
+    await run(sql.set_attachment_stored, file_unique_id, stored_path)
+
+async def set_attachment_error(attachment_id: int, error: str) -> None:
+    """Отмечает вложение, которое не удалось скачать."""
+    await run(sql.set_attachment_error, attachment_id, error)
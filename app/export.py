@@ -0,0 +1,66 @@
+import csv
+import datetime
+import gzip
+import json
+import os
+from typing import IO
+
+from app import sql
+
+FORMATS = ('csv', 'jsonl')
+
+def _open(path: str, compress: bool) -> IO[str]:
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def export_table(path: str, table: str = 'ticket', fmt: str = 'csv', since: int | None = None,
+                 until: int | None = None, status: str | None = None, compress: bool | None = None,
+                 batch_size: int = 1000) -> int:
+    """
+    Выгружает таблицу в файл CSV или JSON Lines и возвращает число выгруженных строк.
+    Строки читаются и записываются пачками, поэтому расход памяти не зависит от размера таблицы.
+    compress=None включает gzip для путей, оканчивающихся на .gz. Файл появляется под итоговым
+    именем только после успешной записи. Функция синхронная: из бота ее вызывают через db.run.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if compress is None:
+        compress = path.endswith('.gz')
+    columns, batches = sql.iter_export_batches(table, since, until, status, batch_size)
+    temp_path = f"{path}.tmp"
+    count = 0
+    try:
+        with _open(temp_path, compress) as file:
+            if fmt == 'csv':
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                for rows in batches:
+                    writer.writerows(rows)
+                    count += len(rows)
+            else:
+                for rows in batches:
+                    file.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+                    count += len(rows)
+        os.replace(temp_path, path)
+    except BaseException:
+        batches.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+def parse_day(value: str) -> int:
+    """Преобразует дату "YYYY-MM-DD" (начало суток по Москве) в секунды с начала эпохи."""
+    epoch = sql.from_moscow_text(f"{value} 00:00:00")
+    if epoch is None:
+        raise ValueError(f"Некорректная дата: {value}")
+    return epoch
+
+def parse_day_end(value: str) -> int:
+    """Преобразует дату "YYYY-MM-DD" в начало следующих суток по Москве: граница периода, включающего эту дату."""
+    try:
+        next_day = datetime.date.fromisoformat(value) + datetime.timedelta(days=1)
+    except ValueError:
+        raise ValueError(f"Некорректная дата: {value}") from None
+    return parse_day(next_day.isoformat())
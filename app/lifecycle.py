@@ -0,0 +1,60 @@
+from typing import Callable, Iterable, NamedTuple
+
+from app import db, sql
+
+# Статусы тикета
+OPEN = "В работе"
+CLOSED = "Завершена"
+
+# Допустимые переходы: действие -> (из статуса, в статус)
+TRANSITIONS: dict[str, tuple[str, str]] = {
+    'close': (OPEN, CLOSED),
+}
+
+class TicketChange(NamedTuple):
+    """Тикет после смены статуса — все, что нужно для уведомлений пользователю и администратору."""
+    number: int
+    tg_id: int
+    organization: str
+    message: str
+    comment: str
+    time_ticket: str
+    state: str
+    created_at: int | None
+    closed_at: int | None
+
+    @property
+    def resolution_seconds(self) -> int | None:
+        """Время выполнения в секундах или None, если тикет не закрыт или время создания неизвестно."""
+        if self.closed_at is None or self.created_at is None:
+            return None
+        return self.closed_at - self.created_at
+
+Notifications = Callable[[list[TicketChange]], Iterable[sql.Notification]]
+
+async def apply(action: str, ticket_ids: Iterable[int], actor: int | None = None,
+                notifications: Notifications | None = None) -> list[TicketChange]:
+    """
+    Выполняет переход action для тикетов ticket_ids одной транзакцией и возвращает измененные тикеты.
+    Тикеты, для которых переход недопустим (уже закрыт, не найден), в результат не попадают,
+    поэтому повторное нажатие «Завершить» ничего не меняет и не рассылает уведомления повторно.
+    """
+    if action not in TRANSITIONS:
+        raise ValueError(f"Неизвестный переход: {action}")
+    from_state, to_state = TRANSITIONS[action]
+    wrapped = None
+    if notifications is not None:
+        wrapped = lambda rows: notifications([TicketChange(*row) for row in rows])
+    rows = await db.transition_tickets(ticket_ids, from_state, to_state, action, actor, wrapped)
+    return [TicketChange(*row) for row in rows]
+
+async def close_ticket(ticket_id: int, actor: int | None = None,
+                       notifications: Notifications | None = None) -> TicketChange | None:
+    """Закрывает тикет; возвращает None, если тикет уже закрыт или не существует."""
+    changes = await apply('close', [ticket_id], actor, notifications)
+    return changes[0] if changes else None
+
+async def close_tickets(ticket_ids: Iterable[int], actor: int | None = None,
+                        notifications: Notifications | None = None) -> list[TicketChange]:
+    """Закрывает несколько тикетов одной транзакцией."""
+    return await apply('close', ticket_ids, actor, notifications)
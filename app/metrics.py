@@ -0,0 +1,173 @@
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from aiohttp import web
+
+import config
+
+# Границы корзин гистограмм длительности, секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Монотонный счетчик с метками в формате Prometheus."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками в формате Prometheus."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.buckets = buckets
+        # метки -> [счетчики по корзинам (последняя — +Inf), сумма]
+        self._values: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(counts), total) for labels, (counts, total) in self._values.items())
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+HANDLER_SECONDS = Histogram('bot_handler_duration_seconds', "Время обработки обновления обработчиком",
+                            ('handler', 'route'))
+HANDLER_ERRORS = Counter('bot_handler_errors_total', "Исключения в обработчиках", ('handler', 'route'))
+QUERY_SECONDS = Histogram('bot_db_query_duration_seconds', "Время выполнения SQL-запроса", ('query',))
+QUERY_ROWS = Counter('bot_db_query_rows_total', "Строк возвращено SQL-запросами", ('query',))
+SLOW_QUERIES = Counter('bot_db_slow_queries_total', "SQL-запросы дольше порога METRICS_SLOW_QUERY_MS", ('query',))
+
+_metrics: list[Counter | Histogram] = [HANDLER_SECONDS, HANDLER_ERRORS, QUERY_SECONDS, QUERY_ROWS, SLOW_QUERIES]
+# Показатели, которые считываются в момент запроса /metrics: функция возвращает {имя: значение}
+_collectors: list[tuple[str, Callable[[], Dict[str, float]]]] = []
+
+def register_collector(prefix: str, collect: Callable[[], Dict[str, float]]) -> None:
+    """Добавляет в /metrics текущие значения из collect() как gauge с именами {prefix}_{ключ}."""
+    _collectors.append((prefix, collect))
+
+@functools.lru_cache(maxsize=1024)
+def query_shape(query: str) -> str:
+    """Приводит SQL-запрос к однострочному виду для метки (значения в запросах передаются параметрами)."""
+    return re.sub(r'\s+', ' ', query).strip()[:160]
+
+def observe_query(query: str, seconds: float, rows: int) -> None:
+    """Учитывает выполненный SQL-запрос и пишет в лог запросы дольше порога."""
+    if not config.METRICS_ENABLED:
+        return
+    shape = query_shape(query)
+    QUERY_SECONDS.observe(seconds, shape)
+    if rows:
+        QUERY_ROWS.inc(rows, shape)
+    if seconds * 1000 >= config.METRICS_SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(1, shape)
+        logging.warning("Медленный запрос (%.0f мс, строк: %s): %s", seconds * 1000, rows, shape)
+
+def _route(event: TelegramObject, data: Dict[str, Any]) -> str:
+    # Числа в callback_data (номера тикетов и страниц) заменяются на N, чтобы не плодить метки
+    if isinstance(event, CallbackQuery):
+        return re.sub(r'\d+', 'N', event.data or '')
+    if data.get('raw_state'):
+        return data['raw_state']
+    if isinstance(event, Message) and event.text and event.text.startswith('/'):
+        return event.text.split()[0]
+    return 'message'
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика с меткой маршрута: callback_data, состояние FSM или команда."""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not config.METRICS_ENABLED:
+            return await handler(event, data)
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+        route = _route(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(1, name, route)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name, route)
+
+def render() -> str:
+    """Возвращает все показатели в текстовом формате Prometheus."""
+    lines: list[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, collect in _collectors:
+        try:
+            values = collect()
+        except Exception:
+            logging.exception("Ошибка сбора показателей %s", prefix)
+            continue
+        for key, value in values.items():
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return '\n'.join(lines) + '\n'
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-store'})
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """Запускает HTTP-сервер с адресом /metrics и возвращает его runner (для остановки через cleanup())."""
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Показатели доступны на http://%s:%s/metrics", host, port)
+    return runner
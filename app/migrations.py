@@ -0,0 +1,343 @@
+import logging
+import sqlite3
+from typing import Callable
+
+# Шаг миграции — набор SQL-запросов или функция, принимающая соединение.
+# Каждая миграция выполняется в отдельной транзакции вместе с записью в schema_version.
+Step = tuple[str, ...] | Callable[[sqlite3.Connection], None]
+
+def _add_epoch_columns(conn: sqlite3.Connection) -> None:
+    # Текстовые даты хранятся по Москве; перевод выполняет та же функция, что и при записи новых строк
+    from app.sql import from_moscow_text
+    conn.create_function("moscow_epoch", 1, from_moscow_text, deterministic=True)
+    conn.execute("ALTER TABLE ticket ADD COLUMN created_at INTEGER")
+    conn.execute("ALTER TABLE ticket ADD COLUMN closed_at INTEGER")
+    conn.execute("ALTER TABLE users ADD COLUMN registered_at INTEGER")
+    conn.execute("UPDATE ticket SET created_at = moscow_epoch(time_ticket)")
+    conn.execute("UPDATE users SET registered_at = moscow_epoch(data_reg)")
+    # Время закрытия старых тикетов неизвестно: closed_at остается пустым и заполняется с этой версии
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_created ON ticket (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_closed ON ticket (closed_at) WHERE closed_at IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_registered ON users (registered_at)")
+    conn.execute("ANALYZE")
+
+MIGRATIONS: list[tuple[int, str, Step]] = [
+    (1, "Базовые таблицы users и ticket", (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            tg_id INTEGER PRIMARY KEY,
+            data_reg TEXT,
+            organization TEXT,
+            organization_adress TEXT,
+            organization_inn TEXT,
+            organization_phone TEXT,
+            history_ticket TEXT,
+            data_ticket TEXT,
+            user_name TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ticket (
+            number_ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_id_ticket INTEGER,
+            organization TEXT,
+            addres_ticket TEXT,
+            message_ticket TEXT,
+            time_ticket TEXT,
+            state_ticket TEXT,
+            ticket_comm TEXT
+        )
+        ''',
+    )),
+    (2, "Индексы для выборок тикетов по пользователю и статусу", (
+        "CREATE INDEX IF NOT EXISTS idx_ticket_user_state ON ticket (tg_id_ticket, state_ticket, number_ticket)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_state ON ticket (state_ticket, number_ticket)",
+        "ANALYZE",
+    )),
+    (3, "Индекс открытых тикетов по организации для админ-панели", (
+        "CREATE INDEX IF NOT EXISTS idx_ticket_state_org ON ticket (state_ticket, organization, number_ticket)",
+        "ANALYZE",
+    )),
+    (4, "Счетчики тикетов по пользователям и статусам, обновляемые триггерами", (
+        # tg_id = 0 — общий счетчик по всем пользователям, -1 — тикеты без пользователя
+        '''
+        CREATE TABLE IF NOT EXISTS ticket_counters (
+            tg_id INTEGER NOT NULL,
+            state_ticket TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tg_id, state_ticket)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_counters_insert AFTER INSERT ON ticket
+        BEGIN
+            INSERT INTO ticket_counters (tg_id, state_ticket, count)
+            VALUES (COALESCE(NEW.tg_id_ticket, -1), COALESCE(NEW.state_ticket, ''), 1)
+            ON CONFLICT (tg_id, state_ticket) DO UPDATE SET count = count + 1;
+            INSERT INTO ticket_counters (tg_id, state_ticket, count)
+            VALUES (0, COALESCE(NEW.state_ticket, ''), 1)
+            ON CONFLICT (tg_id, state_ticket) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_counters_delete AFTER DELETE ON ticket
+        BEGIN
+            UPDATE ticket_counters SET count = count - 1
+            WHERE tg_id IN (COALESCE(OLD.tg_id_ticket, -1), 0) AND state_ticket = COALESCE(OLD.state_ticket, '');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_counters_update AFTER UPDATE OF state_ticket, tg_id_ticket ON ticket
+        WHEN OLD.state_ticket IS NOT NEW.state_ticket OR OLD.tg_id_ticket IS NOT NEW.tg_id_ticket
+        BEGIN
+            UPDATE ticket_counters SET count = count - 1
+            WHERE tg_id IN (COALESCE(OLD.tg_id_ticket, -1), 0) AND state_ticket = COALESCE(OLD.state_ticket, '');
+            INSERT INTO ticket_counters (tg_id, state_ticket, count)
+            VALUES (COALESCE(NEW.tg_id_ticket, -1), COALESCE(NEW.state_ticket, ''), 1)
+            ON CONFLICT (tg_id, state_ticket) DO UPDATE SET count = count + 1;
+            INSERT INTO ticket_counters (tg_id, state_ticket, count)
+            VALUES (0, COALESCE(NEW.state_ticket, ''), 1)
+            ON CONFLICT (tg_id, state_ticket) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        "DELETE FROM ticket_counters",
+        '''
+        INSERT INTO ticket_counters (tg_id, state_ticket, count)
+        SELECT COALESCE(tg_id_ticket, -1), COALESCE(state_ticket, ''), COUNT(*) FROM ticket GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO ticket_counters (tg_id, state_ticket, count)
+        SELECT 0, COALESCE(state_ticket, ''), COUNT(*) FROM ticket GROUP BY 2
+        ''',
+    )),
+    (5, "Очередь исходящих уведомлений (outbox)", (
+        # status: pending — ждет отправки, sent — доставлено, failed — отправка невозможна
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            available_at INTEGER NOT NULL,
+            sent_at INTEGER
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (available_at, id) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox (sent_at) WHERE status = 'sent'",
+    )),
+    (6, "Хранилище состояний FSM", (
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER
+        ) WITHOUT ROWID
+        ''',
+    )),
+    (7, "Время создания и закрытия тикетов и регистрации пользователей в секундах с начала эпохи", _add_epoch_columns),
+    (8, "Накопительные таблицы отчетов для администраторов", (
+        # Тикеты по организациям и дням (день — дата создания по Москве)
+        '''
+        CREATE TABLE IF NOT EXISTS report_created_daily (
+            day TEXT NOT NULL,
+            organization TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, organization)
+        ) WITHOUT ROWID
+        ''',
+        # Гистограмма времени выполнения: день закрытия и время выполнения в минутах
+        '''
+        CREATE TABLE IF NOT EXISTS report_resolution (
+            day TEXT NOT NULL,
+            minutes INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, minutes)
+        ) WITHOUT ROWID
+        ''',
+        # Отметки, до которых тикеты уже учтены в накопительных таблицах
+        '''
+        CREATE TABLE IF NOT EXISTS report_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_ticket_state_created ON ticket (state_ticket, created_at)",
+        "ANALYZE",
+    )),
+    (9, "Полнотекстовый поиск по тикетам (FTS5)", (
+        # Индекс без собственной копии текста: содержимое читается из ticket по number_ticket
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS ticket_fts USING fts5(
+            message_ticket, ticket_comm, organization,
+            content='ticket', content_rowid='number_ticket',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_fts_insert AFTER INSERT ON ticket
+        BEGIN
+            INSERT INTO ticket_fts (rowid, message_ticket, ticket_comm, organization)
+            VALUES (NEW.number_ticket, NEW.message_ticket, NEW.ticket_comm, NEW.organization);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_fts_delete AFTER DELETE ON ticket
+        BEGIN
+            INSERT INTO ticket_fts (ticket_fts, rowid, message_ticket, ticket_comm, organization)
+            VALUES ('delete', OLD.number_ticket, OLD.message_ticket, OLD.ticket_comm, OLD.organization);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_fts_update AFTER UPDATE OF message_ticket, ticket_comm, organization ON ticket
+        BEGIN
+            INSERT INTO ticket_fts (ticket_fts, rowid, message_ticket, ticket_comm, organization)
+            VALUES ('delete', OLD.number_ticket, OLD.message_ticket, OLD.ticket_comm, OLD.organization);
+            INSERT INTO ticket_fts (rowid, message_ticket, ticket_comm, organization)
+            VALUES (NEW.number_ticket, NEW.message_ticket, NEW.ticket_comm, NEW.organization);
+        END
+        ''',
+        "INSERT INTO ticket_fts (ticket_fts) VALUES ('rebuild')",
+    )),
+    (10, "Журнал смены статусов тикетов", (
+        '''
+        CREATE TABLE IF NOT EXISTS ticket_events (
+            id INTEGER PRIMARY KEY,
+            ticket_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            from_state TEXT,
+            to_state TEXT NOT NULL,
+            actor INTEGER,
+            created_at INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_ticket_events_ticket ON ticket_events (ticket_id, id)",
+    )),
+    (11, "Архив завершенных тикетов и представление ticket_all", (
+        # Те же столбцы, что у ticket; номера не пересекаются, так как ticket использует AUTOINCREMENT
+        '''
+        CREATE TABLE IF NOT EXISTS ticket_archive (
+            number_ticket INTEGER PRIMARY KEY,
+            tg_id_ticket INTEGER,
+            organization TEXT,
+            addres_ticket TEXT,
+            message_ticket TEXT,
+            time_ticket TEXT,
+            state_ticket TEXT,
+            ticket_comm TEXT,
+            created_at INTEGER,
+            closed_at INTEGER
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_ticket_archive_user_state ON ticket_archive (tg_id_ticket, state_ticket, number_ticket)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_archive_created ON ticket_archive (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_archive_closed ON ticket_archive (closed_at) WHERE closed_at IS NOT NULL",
+        '''
+        CREATE VIEW IF NOT EXISTS ticket_all AS
+        SELECT number_ticket, tg_id_ticket, organization, addres_ticket, message_ticket, time_ticket, state_ticket, ticket_comm, created_at, closed_at FROM ticket
+        UNION ALL
+        SELECT number_ticket, tg_id_ticket, organization, addres_ticket, message_ticket, time_ticket, state_ticket, ticket_comm, created_at, closed_at FROM ticket_archive
+        ''',
+        # Перенос в архив — удаление из ticket строки, уже записанной в ticket_archive:
+        # счетчики и поисковый индекс при этом не меняются
+        "DROP TRIGGER IF EXISTS trg_ticket_counters_delete",
+        '''
+        CREATE TRIGGER trg_ticket_counters_delete AFTER DELETE ON ticket
+        WHEN NOT EXISTS (SELECT 1 FROM ticket_archive WHERE number_ticket = OLD.number_ticket)
+        BEGIN
+            UPDATE ticket_counters SET count = count - 1
+            WHERE tg_id IN (COALESCE(OLD.tg_id_ticket, -1), 0) AND state_ticket = COALESCE(OLD.state_ticket, '');
+        END
+        ''',
+        "DROP TRIGGER IF EXISTS trg_ticket_fts_delete",
+        '''
+        CREATE TRIGGER trg_ticket_fts_delete AFTER DELETE ON ticket
+        WHEN NOT EXISTS (SELECT 1 FROM ticket_archive WHERE number_ticket = OLD.number_ticket)
+        BEGIN
+            INSERT INTO ticket_fts (ticket_fts, rowid, message_ticket, ticket_comm, organization)
+            VALUES ('delete', OLD.number_ticket, OLD.message_ticket, OLD.ticket_comm, OLD.organization);
+        END
+        ''',
+        # Поисковый индекс читает текст из обеих таблиц, поэтому архивные тикеты тоже находятся
+        "DROP TABLE IF EXISTS ticket_fts",
+        '''
+        CREATE VIRTUAL TABLE ticket_fts USING fts5(
+            message_ticket, ticket_comm, organization,
+            content='ticket_all', content_rowid='number_ticket',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        "INSERT INTO ticket_fts (ticket_fts) VALUES ('rebuild')",
+        "ANALYZE",
+    )),
+    (12, "Вложения тикетов (фото и документы)", (
+        # file_id — для повторной отправки, file_unique_id — ключ локального хранилища (один файл на содержимое)
+        '''
+        CREATE TABLE IF NOT EXISTS ticket_attachments (
+            id INTEGER PRIMARY KEY,
+            ticket_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            file_name TEXT,
+            mime_type TEXT,
+            file_size INTEGER,
+            stored_path TEXT,
+            store_error TEXT,
+            created_at INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_ticket_attachments_ticket ON ticket_attachments (ticket_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_attachments_file ON ticket_attachments (file_unique_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_attachments_pending ON ticket_attachments (id) WHERE stored_path IS NULL AND store_error IS NULL",
+    )),
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Возвращает номер последней примененной миграции (0 для пустой базы)."""
+    row = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()
+    return row[0]
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Применяет к базе все миграции, которых еще нет в schema_version, в порядке возрастания номера.
+    Каждая миграция идет в своей транзакции: при ошибке база остается на предыдущей версии.
+    Возвращает итоговую версию схемы.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    for version, description, step in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        # BEGIN IMMEDIATE сразу берет блокировку записи, поэтому параллельный запуск
+        # из нескольких процессов не применит одну миграцию дважды
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            logging.info("Применение миграции %s: %s", version, description)
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                         (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.exception("Ошибка миграции %s", version)
+            raise
+    return get_schema_version(conn)
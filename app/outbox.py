@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import SendDocument, SendMessage, SendPhoto, TelegramMethod
+
+from app import db, sql
+from app.sender import SendScheduler
+
+# Методы Bot API, которые можно отложить через outbox
+METHODS: dict[str, type[TelegramMethod]] = {
+    SendMessage.__api_method__: SendMessage,
+    # Вложения пересылаются по file_id, поэтому параметры остаются JSON-совместимыми
+    SendPhoto.__api_method__: SendPhoto,
+    SendDocument.__api_method__: SendDocument,
+}
+
+def notification(method: TelegramMethod) -> sql.Notification:
+    """Превращает запрос к Bot API в запись для outbox (имя метода и JSON-совместимые параметры)."""
+    params = {key: value for key, value in method.model_dump(exclude_none=True).items()
+              if not isinstance(value, Default)}
+    return method.__api_method__, params
+
+class OutboxDispatcher:
+    """
+    Фоновая отправка уведомлений из таблицы outbox.
+    Строка отмечается доставленной только после ответа Telegram, поэтому после перезапуска
+    неотправленные уведомления уходят повторно (доставка «как минимум один раз»).
+    """
+
+    def __init__(self, sender: SendScheduler, batch_size: int = 50, interval: float = 5.0,
+                 max_attempts: int = 10, retention: int = 7 * 24 * 3600) -> None:
+        self.sender = sender
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._wakeup = asyncio.Event()
+        self._last_purge = 0.0
+
+    def wake(self) -> None:
+        """Запускает разбор очереди, не дожидаясь очередного интервала опроса."""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Разбирает outbox пачками, пока задача не будет отменена."""
+        while True:
+            try:
+                sent = await self.drain_once()
+                if time.monotonic() - self._last_purge > 3600:
+                    self._last_purge = time.monotonic()
+                    await db.purge_sent_notifications(self.retention)
+            except Exception:
+                logging.exception("Ошибка разбора outbox")
+                sent = 0
+            if sent < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def drain_once(self) -> int:
+        """Отправляет одну пачку уведомлений и возвращает число обработанных строк."""
+        rows = await db.get_pending_notifications(self.batch_size)
+        if not rows:
+            return 0
+        futures = [self.sender.submit(METHODS[method](**params)) for _, method, params, _ in rows]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        delivered = []
+        for (notification_id, _, _, attempts), result in zip(rows, results):
+            if not isinstance(result, BaseException):
+                delivered.append(notification_id)
+            elif isinstance(result, (TelegramForbiddenError, TelegramBadRequest)) or attempts + 1 >= self.max_attempts:
+                logging.error("Уведомление %s не может быть доставлено: %s", notification_id, result)
+                await db.mark_notification_failed(notification_id, str(result))
+            else:
+                await db.reschedule_notification(notification_id, min(2 ** attempts * 10, 3600), str(result))
+        if delivered:
+            await db.mark_notifications_sent(delivered)
+        return len(rows)
@@ -0,0 +1,91 @@
+import math
+import time
+from collections import defaultdict
+
+from app import db, sql
+import config
+
+# Границы возраста открытых заявок (секунд) и их подписи; последняя подпись — старше последней границы
+BACKLOG_BOUNDS = (86400, 3 * 86400, 7 * 86400)
+BACKLOG_LABELS = ("до 1 дня", "1–3 дня", "3–7 дней", "больше 7 дней")
+
+# Закрытия последних секунд учитываются со сдвигом (см. sql.refresh_report_rollups)
+CLOSED_LAG = 60
+
+# Готовые тексты отчетов: число дней -> (момент построения, текст)
+_cache: dict[int, tuple[float, str]] = {}
+
+def percentile(histogram: list[tuple[int, int]], q: float) -> int | None:
+    """Возвращает q-квантиль (0 < q <= 1) по гистограмме [(значение, количество)], отсортированной по значению."""
+    total = sum(count for _, count in histogram)
+    if not total:
+        return None
+    rank = math.ceil(q * total)
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if seen >= rank:
+            return value
+    return histogram[-1][0]
+
+def format_minutes(minutes: int | None) -> str:
+    if minutes is None:
+        return "—"
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    return f"{minutes} мин"
+
+async def build_report(days: int = 7, top: int = 5) -> str:
+    """
+    Строит отчет для администраторов за последние days дней: время выполнения заявок (медиана и p90),
+    возраст открытых заявок и число заявок по организациям и дням.
+    Агрегаты считаются в базе по накопительным таблицам, которые дополняются только новыми тикетами.
+    """
+    now = int(time.time())
+    await db.refresh_report_rollups(now - CLOSED_LAG)
+    since_day = sql.to_moscow_text(now - (days - 1) * 86400)[:10]
+    histogram = await db.get_resolution_histogram(since_day)
+    backlog = await db.get_open_backlog_ages(now, BACKLOG_BOUNDS)
+    created = await db.get_created_daily(since_day)
+
+    closed_total = sum(count for _, count in histogram)
+    text = (
+        f"<b>📊 Отчет за {days} дн.</b> (с {since_day})\n\n"
+        f"<b>⏱ Время выполнения</b>\n"
+        f"Закрыто заявок: {closed_total}\n"
+        f"Медиана: {format_minutes(percentile(histogram, 0.5))}\n"
+        f"90% заявок быстрее: {format_minutes(percentile(histogram, 0.9))}\n\n"
+        f"<b>📬 Открытые заявки по возрасту</b>\n"
+    )
+    for label, count in zip(BACKLOG_LABELS, backlog):
+        text += f"{label}: {count}\n"
+
+    per_organization: dict[str, dict[str, int]] = defaultdict(dict)
+    for day, organization, count in created:
+        per_organization[organization][day] = count
+    day_keys = [sql.to_moscow_text(now - offset * 86400)[:10] for offset in range(days - 1, -1, -1)]
+    ranked = sorted(per_organization.items(), key=lambda item: sum(item[1].values()), reverse=True)
+
+    text += f"\n<b>🏢 Заявки по организациям</b> (по дням, с {since_day})\n"
+    if not ranked:
+        text += "Новых заявок не было.\n"
+    for organization, by_day in ranked[:top]:
+        counts = " · ".join(str(by_day.get(day, 0)) for day in day_keys)
+        text += f"<b>{organization or 'Без организации'}</b> — {sum(by_day.values())}\n<code>{counts}</code>\n"
+    if len(ranked) > top:
+        rest = sum(sum(by_day.values()) for _, by_day in ranked[top:])
+        text += f"Остальные организации ({len(ranked) - top}): {rest}\n"
+    return text
+
+async def get_report(days: int = 7) -> str:
+    """Возвращает отчет за days дней, перестраивая его не чаще раза в REPORT_CACHE_TTL секунд."""
+    entry = _cache.get(days)
+    if entry is not None and time.monotonic() - entry[0] < config.REPORT_CACHE_TTL:
+        return entry[1]
+    text = await build_report(days)
+    _cache[days] = (time.monotonic(), text)
+    return text
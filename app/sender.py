@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+# Приоритеты отправки: ответы на действия пользователя уходят раньше уведомлений
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+class TokenBucket:
+    """Ограничитель частоты: rate отправок в секунду и не более capacity подряд."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self) -> float:
+        """Возвращает, через сколько секунд можно отправить следующее сообщение (0 — сразу)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Запрещает отправку на указанное время (ответ 429 с retry_after)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class _Job:
+    __slots__ = ('method', 'priority', 'future', 'attempts')
+
+    def __init__(self, method: TelegramMethod, priority: int, future: asyncio.Future) -> None:
+        self.method = method
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+def _finish(job: _Job, result: Any = None, error: BaseException | None = None) -> None:
+    # Ожидающий обработчик мог быть отменен — тогда результат просто не нужен
+    if job.future.done():
+        return
+    if error is not None:
+        job.future.set_exception(error)
+    else:
+        job.future.set_result(result)
+
+class SendScheduler:
+    """
+    Очередь исходящих запросов к Telegram с учетом общего лимита бота и лимитов отдельных чатов.
+    Сообщения одного чата уходят строго по порядку; ответы 429 повторяются после retry_after.
+    """
+
+    def __init__(self, bot: Bot, workers: int = 4, global_rate: float = 30.0, chat_rate: float = 1.0,
+                 group_rate: float = 20 / 60, burst: int = 3, max_attempts: int = 5) -> None:
+        self.bot = bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: dict[Any, TokenBucket] = {}
+        self._chats: dict[Any, deque[_Job]] = {}
+        self._scheduled: set[Any] = set()
+        self._ready: asyncio.PriorityQueue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._seq = itertools.count()
+
+    def submit(self, method: TelegramMethod, priority: int = NOTIFICATION) -> asyncio.Future:
+        """Ставит запрос в очередь и возвращает future с его результатом."""
+        loop = asyncio.get_running_loop()
+        if not self._tasks:
+            self._ready = asyncio.PriorityQueue()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        chat_id = getattr(method, 'chat_id', None) or 0
+        job = _Job(method, priority, loop.create_future())
+        self._chats.setdefault(chat_id, deque()).append(job)
+        if chat_id not in self._scheduled:
+            self._schedule(chat_id)
+        return job.future
+
+    async def send(self, method: TelegramMethod, priority: int = INTERACTIVE) -> Any:
+        """Отправляет запрос через очередь и дожидается результата."""
+        return await self.submit(method, priority)
+
+    def set_global_rate(self, rate: float) -> None:
+        """Меняет общий лимит бота (например, чтобы поделить его между несколькими процессами)."""
+        self._global = TokenBucket(rate, max(rate, 1.0))
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки накопленных сообщений (не дольше timeout) и останавливает обработчики."""
+        deadline = time.monotonic() + timeout
+        while self._chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for queue in self._chats.values():
+            for job in queue:
+                job.future.cancel()
+        self._chats.clear()
+        self._scheduled.clear()
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # Полностью восстановившиеся ограничители можно забыть: новые начнут с того же состояния
+                self._buckets = {key: b for key, b in self._buckets.items() if b.delay() > 0 or b.tokens < b.capacity}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id: Any, delay: float = 0.0) -> None:
+        self._scheduled.add(chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._push, chat_id)
+        else:
+            self._push(chat_id)
+
+    def _push(self, chat_id: Any) -> None:
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._chats.pop(chat_id, None)
+            self._scheduled.discard(chat_id)
+            return
+        if self._ready is not None:
+            self._ready.put_nowait((queue[0].priority, next(self._seq), chat_id))
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, chat_id = await self._ready.get()
+            try:
+                await self._process(chat_id)
+            except Exception:
+                logging.exception("Ошибка очереди отправки для чата %s", chat_id)
+                self._schedule(chat_id, 1.0)
+
+    async def _process(self, chat_id: Any) -> None:
+        queue = self._chats[chat_id]
+        job = queue[0]
+        if job.future.done():
+            queue.popleft()
+            self._schedule(chat_id)
+            return
+
+        bucket = self._bucket(chat_id)
+        delay = bucket.delay()
+        if delay > 0:
+            # Чат упирается в свой лимит — освобождаем обработчик для других чатов
+            self._schedule(chat_id, delay)
+            return
+        while (delay := self._global.delay()) > 0:
+            await asyncio.sleep(delay)
+        bucket.consume()
+        self._global.consume()
+
+        try:
+            result = await self.bot(job.method)
+        except TelegramRetryAfter as error:
+            job.attempts += 1
+            if job.attempts < self.max_attempts:
+                logging.warning("Лимит Telegram для чата %s, повтор через %s с", chat_id, error.retry_after)
+                bucket.pause(error.retry_after)
+                self._schedule(chat_id, error.retry_after)
+                return
+            queue.popleft()
+            _finish(job, error=error)
+        except TelegramNetworkError as error:
+            job.attempts += 1
+            if job.attempts < self.max_attempts:
+                self._schedule(chat_id, 2 ** job.attempts)
+                return
+            queue.popleft()
+            _finish(job, error=error)
+        except Exception as error:
+            queue.popleft()
+            _finish(job, error=error)
+        else:
+            queue.popleft()
+            _finish(job, result)
+        self._schedule(chat_id)
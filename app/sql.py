@@ -1,11 +1,53 @@
 import sqlite3
+import calendar
 import datetime
+import functools
 import json
-from typing import Any, Iterable, Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Optional
 from zoneinfo import ZoneInfo
 
+from app import metrics, migrations
+import config
+
 DB_PATH = 'app/database.db'
 MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Настройки соединения: WAL позволяет читать во время записи, остальное — кэш страниц и ожидание блокировок
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+# LRU-кэш профилей: tg_id -> (момент записи, профиль). Порядок OrderedDict — порядок последнего обращения.
+_user_cache: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {'hits': 0, 'misses': 0}
+# Номер последней записи в users: чтение, начатое до записи, не должно положить в кэш устаревший профиль
+_user_cache_writes = 0
+# Версии данных пользователей для app.views: меняются при каждой записи профиля или тикетов пользователя.
+# _data_epoch меняется, когда устаревают данные всех пользователей сразу.
+_data_versions: dict[int, int] = {}
+_data_epoch = 0
+
+# Уведомление для outbox: имя метода Bot API и его параметры (JSON-совместимый словарь с chat_id)
+Notification = tuple[str, dict]
+# Вложение тикета: (вид — photo или document, file_id, file_unique_id, имя файла, MIME-тип, размер)
+Attachment = tuple[str, str, str, str | None, str | None, int | None]
 
 def parse_to_moscow_naive(dt_input: datetime.datetime | str | None) -> datetime.datetime:
     """
@@ -34,53 +76,176 @@ def parse_to_moscow_naive(dt_input: datetime.datetime | str | None) -> datetime.
         dt = dt.replace(tzinfo=datetime.timezone.utc)
     return dt.astimezone(MOSCOW_TZ).replace(tzinfo=None)
 
+@functools.lru_cache(maxsize=4096)
+def _moscow_offset(hour: int) -> int:
+    """Смещение московского времени от UTC в секундах для часа hour (часов с начала эпохи)."""
+    # Переходы смещения происходят на границе часа, поэтому одного значения на час достаточно
+    return int(datetime.datetime.fromtimestamp(hour * 3600, MOSCOW_TZ).utcoffset().total_seconds())
+
+def to_moscow_text(epoch: int) -> str:
+    """Форматирует время в секундах с начала эпохи как московское "YYYY-MM-DD HH:MM:SS"."""
+    return time.strftime(TIME_FORMAT, time.gmtime(epoch + _moscow_offset(epoch // 3600)))
+
+def from_moscow_text(text: str | None) -> int | None:
+    """
+    Преобразует московское время "YYYY-MM-DD HH:MM:SS" в секунды с начала эпохи.
+    Строки другого формата разбираются как ISO 8601; нераспознанные значения дают None.
+    """
+    if not text:
+        return None
+    if len(text) == 19 and text[4] == '-' and text[10] == ' ':
+        try:
+            local = calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                     int(text[11:13]), int(text[14:16]), int(text[17:19])))
+        except ValueError:
+            return None
+        return local - _moscow_offset((local - _moscow_offset(local // 3600)) // 3600)
+    try:
+        dt = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=MOSCOW_TZ)
+    return int(dt.timestamp())
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока, открывая его при первом обращении.
+    Соединение живет до close_connections() и переиспользует кэш подготовленных запросов.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.generation == _generation and _local.path == DB_PATH:
+        return conn
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _connections_lock:
+        _connections.append(conn)
+    _local.conn = conn
+    _local.generation = _generation
+    _local.path = DB_PATH
+    return conn
+
+def close_connections() -> None:
+    """Закрывает все открытые соединения. Потоки при следующем запросе откроют новые."""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+
 def execute_query(query: str, params: tuple | None = None, fetch_one: bool = False) -> list[tuple] | tuple | None:
     """
     Выполняет SQL-запрос и возвращает результаты.
     Если fetch_one=True — возвращает одну строку или None. Иначе — все строки.
-    Фиксирует изменения (commit) только для не-SELECT запросов.
+    Для запросов, не возвращающих строк, возвращает None. Изменения фиксируются (commit) сразу.
     """
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, params or ())
-        if query.strip().upper().startswith("SELECT"):
+    conn = get_connection()
+    started = time.perf_counter()
+    with conn:
+        cursor = conn.execute(query, params or ())
+        if cursor.description is not None:
             result = cursor.fetchone() if fetch_one else cursor.fetchall()
         else:
-            conn.commit()
             result = None
-        return result
+    rows = len(result) if isinstance(result, list) else int(result is not None)
+    metrics.observe_query(query, time.perf_counter() - started, rows)
+    return result
+
+@contextmanager
+def transaction(name: str = "transaction") -> Iterator[sqlite3.Connection]:
+    """
+    Выполняет несколько запросов одной транзакцией на соединении текущего потока.
+    При выходе без ошибок — commit, при исключении — rollback.
+    Время всего блока вместе с ожиданием блокировки записи учитывается в метриках запросов как "transaction <name>".
+    """
+    conn = get_connection()
+    started = time.perf_counter()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        metrics.observe_query(f"transaction {name}", time.perf_counter() - started, 0)
 
 def create_tables():
     """
-    Создает таблицы базы данных, если они еще не существуют.
-    """
-    users = '''
-        CREATE TABLE IF NOT EXISTS users (
-            tg_id INTEGER PRIMARY KEY,
-            data_reg TEXT,
-            organization TEXT,
-            organization_adress TEXT,
-            organization_inn TEXT,
-            organization_phone TEXT,
-            history_ticket TEXT,
-            data_ticket TEXT,
-            user_name TEXT
-        )
-    '''
-    ticket = '''
-        CREATE TABLE IF NOT EXISTS ticket (
-            number_ticket INTEGER PRIMARY KEY AUTOINCREMENT,
-            tg_id_ticket INTEGER,
-            organization TEXT,
-            addres_ticket TEXT,
-            message_ticket TEXT,
-            time_ticket TEXT,
-            state_ticket TEXT,
-            ticket_comm TEXT
-        )
-    '''
-    execute_query(users)
-    execute_query(ticket)
+    Создает и обновляет таблицы базы данных, применяя недостающие миграции из app.migrations.
+    """
+    migrations.apply_migrations(get_connection())
+
+def _cache_user(tg_id: int, user: dict, writes: int | None = None) -> None:
+    """Кладет профиль в кэш. Если передан writes, профиль сохраняется, только если с тех пор не было записей."""
+    if not config.USER_CACHE_ENABLED:
+        return
+    with _user_cache_lock:
+        if writes is not None and writes != _user_cache_writes:
+            return
+        _user_cache[tg_id] = (time.monotonic(), user)
+        _user_cache.move_to_end(tg_id)
+        while len(_user_cache) > config.USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+
+def _cached_user(tg_id: int) -> dict | None:
+    """Возвращает копию профиля из кэша или None, если его там нет или запись устарела."""
+    if not config.USER_CACHE_ENABLED:
+        return None
+    with _user_cache_lock:
+        entry = _user_cache.get(tg_id)
+        if entry is not None and time.monotonic() - entry[0] < config.USER_CACHE_TTL:
+            _user_cache.move_to_end(tg_id)
+            _user_cache_stats['hits'] += 1
+            return dict(entry[1])
+        if entry is not None:
+            del _user_cache[tg_id]
+        _user_cache_stats['misses'] += 1
+        return None
+
+def _update_cached_user(tg_id: int, **fields: Any) -> None:
+    """Обновляет поля профиля в кэше после записи в users."""
+    global _user_cache_writes
+    with _user_cache_lock:
+        _user_cache_writes += 1
+        _data_versions[tg_id] = _data_versions.get(tg_id, 0) + 1
+        entry = _user_cache.get(tg_id)
+        if entry is not None:
+            _user_cache[tg_id] = (entry[0], {**entry[1], **fields})
+
+def invalidate_user_cache(tg_id: int | None = None) -> None:
+    """Удаляет профиль пользователя из кэша. Без tg_id очищает кэш целиком."""
+    global _user_cache_writes
+    with _user_cache_lock:
+        _user_cache_writes += 1
+        if tg_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(tg_id, None)
+    bump_data_version(tg_id)
+
+def bump_data_version(tg_id: int | None = None) -> None:
+    """Отмечает изменение данных пользователя (без tg_id — всех пользователей)."""
+    global _data_epoch
+    with _user_cache_lock:
+        if tg_id is None:
+            _data_epoch += 1
+            _data_versions.clear()
+        else:
+            _data_versions[tg_id] = _data_versions.get(tg_id, 0) + 1
+
+def get_data_version(tg_id: int) -> tuple[int, int]:
+    """Возвращает текущую версию данных пользователя; по ней app.views проверяет актуальность памяти."""
+    with _user_cache_lock:
+        return _data_epoch, _data_versions.get(tg_id, 0)
+
+def get_user_cache_stats() -> dict[str, int]:
+    """Возвращает число попаданий и промахов кэша профилей и его текущий размер."""
+    with _user_cache_lock:
+        return {**_user_cache_stats, 'size': len(_user_cache)}
 
 def add_user(tg_id: int, data_reg: str, organization: str, organization_adress: str,
              organization_inn: str, organization_phone: str, history_ticket: str = "",
@@ -88,18 +253,36 @@ def add_user(tg_id: int, data_reg: str, organization: str, organization_adress:
     """Добавляет нового пользователя в базу данных."""
     query = '''INSERT INTO users (tg_id, data_reg, organization, organization_adress,
                                  organization_inn, organization_phone, history_ticket,
-                                 data_ticket, user_name)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+                                 data_ticket, user_name, registered_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    registered_at = from_moscow_text(data_reg)
     execute_query(query, (tg_id, data_reg, organization, organization_adress,
                          organization_inn, organization_phone, history_ticket,
-                         data_ticket, user_name))
+                         data_ticket, user_name, registered_at))
+    invalidate_user_cache(tg_id)
+    _cache_user(tg_id, {
+        'tg_id': tg_id,
+        'data_reg': data_reg,
+        'organization': organization,
+        'organization_adress': organization_adress,
+        'organization_inn': organization_inn,
+        'organization_phone': organization_phone,
+        'history_ticket': history_ticket,
+        'data_ticket': data_ticket,
+        'user_name': user_name,
+        'registered_at': registered_at
+    })
 
 def get_user_by_id(tg_id: int) -> dict | None:
-    """Возвращает информацию о пользователе по Telegram ID."""
+    """Возвращает информацию о пользователе по Telegram ID. Повторные запросы обслуживаются из кэша."""
+    user = _cached_user(tg_id)
+    if user is not None:
+        return user
+    writes = _user_cache_writes
     query = "SELECT * FROM users WHERE tg_id = ?"
     row = execute_query(query, (tg_id,), fetch_one=True)
     if row:
-        return {
+        user = {
             'tg_id': row[0],
             'data_reg': row[1],
             'organization': row[2],
@@ -108,25 +291,55 @@ def get_user_by_id(tg_id: int) -> dict | None:
             'organization_phone': row[5],
             'history_ticket': row[6],
             'data_ticket': row[7],
-            'user_name': row[8]
+            'user_name': row[8],
+            'registered_at': row[9]
         }
+        _cache_user(tg_id, user, writes)
+        return dict(user)
     return None
 
 def update_user_field(tg_id: int, field_name: str, value: str) -> None:
     """Обновляет указанное поле пользователя."""
     query = f"UPDATE users SET {field_name} = ? WHERE tg_id = ?"
     execute_query(query, (value, tg_id))
+    _update_cached_user(tg_id, **{field_name: value})
 
 def add_ticket(tg_id_ticket: int, organization: str, addres_ticket: str, message_ticket: str,
                time_ticket: str, state_ticket: str, ticket_comm: str) -> None:
     """Добавляет новый тикет в базу данных."""
     query = '''
         INSERT INTO ticket (tg_id_ticket, organization, addres_ticket, message_ticket,
-                           time_ticket, state_ticket, ticket_comm)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+                           time_ticket, state_ticket, ticket_comm, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     '''
     execute_query(query, (tg_id_ticket, organization, addres_ticket, message_ticket,
-                         time_ticket, state_ticket, ticket_comm))
+                         time_ticket, state_ticket, ticket_comm, from_moscow_text(time_ticket)))
+
+def create_ticket(tg_id_ticket: int, organization: str, addres_ticket: str, message_ticket: str,
+                  time_ticket: str, user_name: str | None, state_ticket: str = "В работе",
+                  ticket_comm: str = "",
+                  notifications: Callable[[int], Iterable[Notification]] | None = None,
+                  attachments: Iterable[Attachment] = ()) -> int:
+    """
+    Создает тикет и записывает его номер, время и имя пользователя в профиль одной транзакцией.
+    notifications получает номер нового тикета и возвращает уведомления, которые попадут в outbox
+    в той же транзакции. attachments — вложения тикета. Возвращает номер созданного тикета.
+    """
+    with transaction("create_ticket") as conn:
+        cursor = conn.execute('''
+            INSERT INTO ticket (tg_id_ticket, organization, addres_ticket, message_ticket,
+                               time_ticket, state_ticket, ticket_comm, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (tg_id_ticket, organization, addres_ticket, message_ticket, time_ticket, state_ticket, ticket_comm,
+              from_moscow_text(time_ticket)))
+        ticket_id = cursor.lastrowid
+        conn.execute("UPDATE users SET history_ticket = ?, data_ticket = ?, user_name = ? WHERE tg_id = ?",
+                     (str(ticket_id), time_ticket, user_name, tg_id_ticket))
+        _add_attachments(conn, ticket_id, attachments)
+        if notifications is not None:
+            _enqueue_notifications(conn, notifications(ticket_id))
+    _update_cached_user(tg_id_ticket, history_ticket=str(ticket_id), data_ticket=time_ticket, user_name=user_name)
+    return ticket_id
 
 def get_last_ticket_number() -> int:
     """Возвращает номер последнего тикета."""
@@ -136,42 +349,453 @@ def get_last_ticket_number() -> int:
 
 def get_ticket_count(tg_id: int | None, status: str) -> int:
     """Возвращает количество тикетов с указанным статусом. Если tg_id=None — для всех пользователей."""
-    query = "SELECT COUNT(*) FROM ticket WHERE state_ticket = ?"
-    params = (status,)
-    if tg_id is not None:
-        query += " AND tg_id_ticket = ?"
-        params = (status, tg_id)
-    row = execute_query(query, params, fetch_one=True)
+    query = "SELECT count FROM ticket_counters WHERE tg_id = ? AND state_ticket = ?"
+    row = execute_query(query, (tg_id or 0, status), fetch_one=True)
     return row[0] if row else 0
 
+def get_ticket_status_totals(tg_id: int | None = None) -> dict[str, int]:
+    """Возвращает количество тикетов по каждому статусу одним запросом. Если tg_id=None — для всех пользователей."""
+    query = "SELECT state_ticket, count FROM ticket_counters WHERE tg_id = ?"
+    return dict(execute_query(query, (tg_id or 0,)))
+
+# Счетчики учитывают и архивные тикеты (представление ticket_all — ticket и ticket_archive)
+_COUNTERS_FROM_TICKETS = '''
+    SELECT COALESCE(tg_id_ticket, -1), COALESCE(state_ticket, ''), COUNT(*) FROM ticket_all GROUP BY 1, 2
+    UNION ALL
+    SELECT 0, COALESCE(state_ticket, ''), COUNT(*) FROM ticket_all GROUP BY 2
+'''
+
+def verify_ticket_counters() -> list[tuple[int, str, int, int]]:
+    """
+    Сверяет таблицу ticket_counters с фактическим количеством тикетов.
+    Возвращает расхождения в виде (tg_id, статус, значение счетчика, фактическое значение).
+    """
+    query = f'''
+        WITH actual (tg_id, state_ticket, count) AS ({_COUNTERS_FROM_TICKETS}),
+        keys AS (SELECT tg_id, state_ticket FROM actual UNION SELECT tg_id, state_ticket FROM ticket_counters)
+        SELECT keys.tg_id, keys.state_ticket, COALESCE(c.count, 0), COALESCE(a.count, 0)
+        FROM keys
+        LEFT JOIN ticket_counters c ON c.tg_id = keys.tg_id AND c.state_ticket = keys.state_ticket
+        LEFT JOIN actual a ON a.tg_id = keys.tg_id AND a.state_ticket = keys.state_ticket
+        WHERE COALESCE(c.count, 0) != COALESCE(a.count, 0)
+    '''
+    return execute_query(query)
+
+def rebuild_ticket_counters() -> None:
+    """Пересчитывает ticket_counters по таблицам ticket и ticket_archive одной транзакцией."""
+    with transaction("rebuild_ticket_counters") as conn:
+        conn.execute("DELETE FROM ticket_counters")
+        conn.execute(f"INSERT INTO ticket_counters (tg_id, state_ticket, count) {_COUNTERS_FROM_TICKETS}")
+    bump_data_version()
+
 def get_tickets_in_progress_by_user_id(tg_id: int) -> list[tuple]:
     """Возвращает список тикетов пользователя в статусе "В работе"."""
-    query = "SELECT * FROM ticket WHERE tg_id_ticket = ? AND state_ticket = ?"
+    query = "SELECT * FROM ticket WHERE tg_id_ticket = ? AND state_ticket = ? ORDER BY number_ticket"
     return execute_query(query, (tg_id, "В работе"))
 
 def get_all_tickets_in_progress() -> list[tuple]:
     """Возвращает список всех тикетов в статусе "В работе"."""
-    return execute_query("SELECT * FROM ticket WHERE state_ticket = ?", ("В работе",))
+    return execute_query("SELECT * FROM ticket WHERE state_ticket = ? ORDER BY number_ticket", ("В работе",))
 
 def get_ticket_info(ticket_id: int) -> tuple | None:
-    """Возвращает информацию о тикете по его номеру."""
-    return execute_query("SELECT * FROM ticket WHERE number_ticket = ?", (ticket_id,), fetch_one=True)
+    """Возвращает информацию о тикете по его номеру (в том числе архивном)."""
+    return execute_query("SELECT * FROM ticket_all WHERE number_ticket = ?", (ticket_id,), fetch_one=True)
+
+# Поля тикета, которые возвращает смена статуса (см. transition_tickets)
+TRANSITION_COLUMNS = ('number_ticket', 'tg_id_ticket', 'organization', 'message_ticket', 'ticket_comm',
+                      'time_ticket', 'state_ticket', 'created_at', 'closed_at')
+
+def transition_tickets(ticket_ids: Iterable[int], from_state: str, to_state: str, event: str,
+                       actor: int | None = None,
+                       notifications: Callable[[list[tuple]], Iterable[Notification]] | None = None) -> list[tuple]:
+    """
+    Переводит тикеты из статуса from_state в to_state одним условным UPDATE ... RETURNING и записывает
+    событие в ticket_events. Тикеты в другом статусе (например, уже завершенные) не меняются.
+    notifications получает измененные строки и возвращает уведомления для outbox — все в одной транзакции.
+    Возвращает измененные строки (поля TRANSITION_COLUMNS) по возрастанию номера.
+    """
+    ids = json.dumps(sorted(set(ticket_ids)))
+    now = int(time.time())
+    closed_at = now if to_state == "Завершена" else None
+    with transaction("transition_tickets") as conn:
+        rows = conn.execute(f'''
+            UPDATE ticket SET state_ticket = ?, closed_at = ?
+            WHERE number_ticket IN (SELECT value FROM json_each(?))
+              AND state_ticket = ?
+            RETURNING {", ".join(TRANSITION_COLUMNS)}
+        ''', (to_state, closed_at, ids, from_state)).fetchall()
+        rows.sort()
+        conn.executemany(
+            "INSERT INTO ticket_events (ticket_id, event, from_state, to_state, actor, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(row[0], event, from_state, to_state, actor, now) for row in rows]
+        )
+        if notifications is not None and rows:
+            _enqueue_notifications(conn, notifications(rows))
+    for tg_id in {row[1] for row in rows}:
+        bump_data_version(tg_id)
+    return rows
+
+_ARCHIVE_COLUMNS = ('number_ticket, tg_id_ticket, organization, addres_ticket, message_ticket, time_ticket, '
+                    'state_ticket, ticket_comm, created_at, closed_at')
+
+def archive_closed_tickets(closed_before: int, limit: int = 500) -> int:
+    """
+    Переносит до limit завершенных тикетов, закрытых раньше closed_before (секунды с начала эпохи),
+    из ticket в ticket_archive одной короткой транзакцией и возвращает число перенесенных.
+    Для тикетов, закрытых до появления closed_at, возраст считается по времени создания.
+    Счетчики и поисковый индекс не меняются: триггеры удаления пропускают строки, уже попавшие в архив.
+    """
+    with transaction("archive_closed_tickets") as conn:
+        moved = conn.execute(f'''
+            INSERT INTO ticket_archive ({_ARCHIVE_COLUMNS})
+            SELECT {_ARCHIVE_COLUMNS} FROM ticket
+            WHERE state_ticket = ? AND created_at < ? AND COALESCE(closed_at, created_at) < ?
+            ORDER BY created_at LIMIT ?
+            RETURNING number_ticket, tg_id_ticket
+        ''', ("Завершена", closed_before, closed_before, limit)).fetchall()
+        if moved:
+            conn.execute("DELETE FROM ticket WHERE number_ticket IN (SELECT value FROM json_each(?))",
+                         (json.dumps([number for number, _ in moved]),))
+    for tg_id in {tg_id for _, tg_id in moved}:
+        bump_data_version(tg_id)
+    return len(moved)
 
-def update_ticket_status(ticket_id: int, new_status: str) -> None:
-    """Обновляет статус тикета."""
-    execute_query("UPDATE ticket SET state_ticket = ? WHERE number_ticket = ?", (new_status, ticket_id))
+def get_ticket_events(ticket_id: int) -> list[tuple]:
+    """Возвращает историю смены статусов тикета: (событие, из статуса, в статус, кто, когда)."""
+    return execute_query("SELECT event, from_state, to_state, actor, created_at FROM ticket_events WHERE ticket_id = ? ORDER BY id",
+                         (ticket_id,))
 
 def get_completed_tickets_by_user(tg_id: int) -> list[tuple]:
     """Возвращает список завершенных тикетов пользователя."""
-    return execute_query("SELECT * FROM ticket WHERE tg_id_ticket = ? AND state_ticket = ?",
+    return execute_query("SELECT * FROM ticket_all WHERE tg_id_ticket = ? AND state_ticket = ? ORDER BY number_ticket",
                         (tg_id, "Завершена"))
 
+def _report_watermark(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute("SELECT value FROM report_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def _set_report_watermark(conn: sqlite3.Connection, name: str, value: int) -> None:
+    conn.execute("INSERT INTO report_state (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                 (name, value))
+
+# Сколько тикетов каждого вида дописывается в накопительные таблицы отчетов одной транзакцией
+# и пауза между такими транзакциями, секунд: без нее запись обработчиков ждала бы всего пересчета
+REPORT_CHUNK_SIZE = 5000
+REPORT_CHUNK_PAUSE = 0.02
+
+def refresh_report_rollups(closed_until: int, limit: int = REPORT_CHUNK_SIZE) -> bool:
+    """
+    Дописывает в накопительные таблицы отчетов очередную порцию тикетов, появившихся с прошлого обновления:
+    не больше limit созданных и примерно limit закрытых, одной короткой транзакцией. Возвращает True,
+    когда таблицы догнали текущее состояние, и False, если вызов нужно повторить (после паузы
+    REPORT_CHUNK_PAUSE). Так и первое заполнение по всей истории тикетов не держит блокировку записи долго.
+    Созданные тикеты учитываются по номеру (он только растет), закрытые — по closed_at до closed_until.
+    closed_until берется с запасом от текущего времени: closed_at вычисляется до начала транзакции
+    закрытия, и тикет, ожидающий блокировку записи, может получить время меньше уже обработанного.
+    """
+    offset = _moscow_offset(int(time.time()) // 3600)
+    with transaction("refresh_report_rollups") as conn:
+        last_ticket = _report_watermark(conn, 'created_ticket')
+        max_ticket = conn.execute("SELECT COALESCE(MAX(number_ticket), 0) FROM ticket").fetchone()[0]
+        upper_ticket = min(max_ticket, last_ticket + limit)
+        if upper_ticket > last_ticket:
+            conn.execute('''
+                INSERT INTO report_created_daily (day, organization, count)
+                SELECT date(created_at + ?, 'unixepoch'), COALESCE(organization, ''), COUNT(*)
+                FROM ticket WHERE number_ticket > ? AND number_ticket <= ? AND created_at IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT (day, organization) DO UPDATE SET count = count + excluded.count
+            ''', (offset, last_ticket, upper_ticket))
+            _set_report_watermark(conn, 'created_ticket', upper_ticket)
+
+        last_closed = _report_watermark(conn, 'closed_at')
+        upper_closed = closed_until
+        if closed_until > last_closed:
+            # Граница порции — closed_at limit-го тикета после отметки; тикеты с тем же closed_at
+            # попадают в ту же порцию, иначе часть из них была бы пропущена
+            row = conn.execute("SELECT closed_at FROM ticket WHERE closed_at > ? AND closed_at <= ? ORDER BY closed_at LIMIT 1 OFFSET ?",
+                               (last_closed, closed_until, limit - 1)).fetchone()
+            if row is not None:
+                upper_closed = row[0]
+            conn.execute('''
+                INSERT INTO report_resolution (day, minutes, count)
+                SELECT date(closed_at + ?, 'unixepoch'), MAX(closed_at - created_at, 0) / 60, COUNT(*)
+                FROM ticket WHERE closed_at > ? AND closed_at <= ? AND created_at IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT (day, minutes) DO UPDATE SET count = count + excluded.count
+            ''', (offset, last_closed, upper_closed))
+            _set_report_watermark(conn, 'closed_at', upper_closed)
+    return upper_ticket >= max_ticket and upper_closed >= closed_until
+
+def get_created_daily(since_day: str) -> list[tuple[str, str, int]]:
+    """Возвращает число созданных тикетов по дням и организациям начиная с даты since_day ("YYYY-MM-DD")."""
+    query = "SELECT day, organization, count FROM report_created_daily WHERE day >= ? ORDER BY day"
+    return execute_query(query, (since_day,))
+
+def get_resolution_histogram(since_day: str) -> list[tuple[int, int]]:
+    """Возвращает гистограмму времени выполнения (минуты, число тикетов) для тикетов, закрытых с даты since_day."""
+    query = "SELECT minutes, SUM(count) FROM report_resolution WHERE day >= ? GROUP BY minutes ORDER BY minutes"
+    return execute_query(query, (since_day,))
+
+def get_open_backlog_ages(now: int, bounds: list[int]) -> list[int]:
+    """
+    Возвращает число тикетов в работе по возрасту: для границ bounds (секунд, по возрастанию)
+    первый элемент — тикеты моложе bounds[0], последний — старше последней границы.
+    """
+    edges = [now - bound for bound in bounds]
+    columns = ["SUM(created_at > ?)"]
+    columns += ["SUM(created_at <= ? AND created_at > ?)"] * (len(edges) - 1)
+    columns.append("SUM(created_at <= ?)")
+    params = [edges[0]]
+    for newer, older in zip(edges, edges[1:]):
+        params += [newer, older]
+    params += [edges[-1], "В работе"]
+    query = f"SELECT {', '.join(columns)} FROM ticket WHERE state_ticket = ?"
+    return [count or 0 for count in execute_query(query, tuple(params), fetch_one=True)]
+
+# Таблицы, доступные для выгрузки: столбец времени для фильтра по датам и столбец статуса (если есть)
+EXPORT_TABLES: dict[str, tuple[str, str | None]] = {
+    'ticket': ('created_at', 'state_ticket'),
+    'users': ('registered_at', None),
+}
+# Таблицы, из которых читается выгрузка: архивные тикеты выгружаются вместе с рабочими
+EXPORT_SOURCES: dict[str, tuple[str, ...]] = {
+    'ticket': ('ticket_archive', 'ticket'),
+}
+
+def iter_export_batches(table: str, since: int | None = None, until: int | None = None, status: str | None = None,
+                        batch_size: int = 1000) -> tuple[list[str], Iterator[list[tuple]]]:
+    """
+    Читает таблицу для выгрузки пачками по batch_size строк, не загружая ее в память целиком.
+    since/until ограничивают время создания (секунды с начала эпохи, интервал [since, until)),
+    status — статус тикета. Возвращает имена столбцов и итератор пачек строк.
+    """
+    time_column, status_column = EXPORT_TABLES[table]
+    conditions, params = [], []
+    if since is not None:
+        conditions.append(f"{time_column} >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append(f"{time_column} < ?")
+        params.append(until)
+    if status is not None:
+        if status_column is None:
+            raise ValueError(f"Таблица {table} не поддерживает фильтр по статусу")
+        conditions.append(f"{status_column} = ?")
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = get_connection()
+    cursors = [conn.execute(f"SELECT * FROM {source} {where} ORDER BY rowid", params)
+               for source in EXPORT_SOURCES.get(table, (table,))]
+    columns = [column[0] for column in cursors[0].description]
+
+    def batches() -> Iterator[list[tuple]]:
+        try:
+            for cursor in cursors:
+                while rows := cursor.fetchmany(batch_size):
+                    yield rows
+        finally:
+            for cursor in cursors:
+                cursor.close()
+    return columns, batches()
+
+def _keyset_page(query: str, params: tuple, after: int | None, before: int | None,
+                 limit: int, descending: bool = False) -> tuple[list[tuple], bool, bool]:
+    """
+    Постраничная выборка тикетов по number_ticket без OFFSET: стоимость страницы не зависит от ее номера.
+    after — номер последнего тикета предыдущей страницы (листание вперед),
+    before — номер первого тикета следующей страницы (листание назад).
+    Возвращает строки страницы в порядке отображения и признаки наличия предыдущей и следующей страниц.
+    """
+    backward = before is not None
+    cursor = before if backward else after
+    scan_desc = descending != backward
+    if cursor is not None:
+        query += f" AND number_ticket {'<' if scan_desc else '>'} ?"
+        params += (cursor,)
+    query += f" ORDER BY number_ticket {'DESC' if scan_desc else 'ASC'} LIMIT ?"
+    rows = execute_query(query, params + (limit + 1,))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+        return rows, has_more, True
+    return rows, cursor is not None, has_more
+
+def get_completed_tickets_page(tg_id: int, after: int | None = None, before: int | None = None,
+                               limit: int = 4) -> tuple[list[tuple], bool, bool]:
+    """Возвращает страницу завершенных тикетов пользователя и признаки наличия предыдущей и следующей страниц."""
+    return _keyset_page("SELECT * FROM ticket_all WHERE tg_id_ticket = ? AND state_ticket = ?",
+                        (tg_id, "Завершена"), after, before, limit)
+
+def get_open_tickets_page(organization: str | None = None, after: int | None = None, before: int | None = None,
+                          limit: int = 8, newest_first: bool = False) -> tuple[list[tuple], bool, bool]:
+    """
+    Возвращает страницу тикетов в статусе "В работе" (по умолчанию сначала самые старые)
+    и признаки наличия предыдущей и следующей страниц. organization — фильтр по организации.
+    """
+    query = "SELECT * FROM ticket WHERE state_ticket = ?"
+    params: tuple = ("В работе",)
+    if organization is not None:
+        query += " AND organization = ?"
+        params += (organization,)
+    return _keyset_page(query, params, after, before, limit, descending=newest_first)
+
+def get_open_ticket_organizations(limit: int = 20) -> list[tuple[str, int]]:
+    """Возвращает организации с открытыми тикетами и количество их тикетов, начиная с самых загруженных."""
+    query = '''
+        SELECT organization, COUNT(*) FROM ticket
+        WHERE state_ticket = ?
+        GROUP BY organization
+        ORDER BY COUNT(*) DESC, organization
+        LIMIT ?
+    '''
+    return execute_query(query, ("В работе", limit))
+
+SEARCH_CANDIDATES = 5000
+
+def fts_query(text: str) -> str | None:
+    """
+    Превращает текст из поиска в запрос FTS5: каждое слово ищется как префикс
+    (так находятся и другие падежи), все слова должны встретиться. Спецсимволы FTS5 экранируются.
+    """
+    words = [word for word in text.split() if any(char.isalnum() for char in word)]
+    if not words:
+        return None
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+def search_tickets(text: str, offset: int = 0, limit: int = 5) -> tuple[list[tuple], bool]:
+    """
+    Ищет тикеты по тексту сообщения, комментарию и организации, начиная с самых релевантных.
+    Возвращает строки (номер, организация, время, статус, сообщение, комментарий)
+    и признак наличия следующей страницы.
+    """
+    match = fts_query(text)
+    if match is None:
+        return [], False
+    # bm25 считается для каждого совпадения, поэтому для частых слов ранжируются только
+    # SEARCH_CANDIDATES самых новых совпадений. snippet() не используется: для префиксного запроса
+    # FTS5 заново собирает список совпадений на каждую строку, фрагмент строит app.views
+    query = '''
+        WITH candidates AS (
+            SELECT rowid, rank FROM ticket_fts WHERE ticket_fts MATCH ?
+            ORDER BY rowid DESC LIMIT ?
+        )
+        SELECT c.rowid, COALESCE(t.organization, a.organization), COALESCE(t.time_ticket, a.time_ticket),
+               COALESCE(t.state_ticket, a.state_ticket), COALESCE(t.message_ticket, a.message_ticket),
+               COALESCE(t.ticket_comm, a.ticket_comm)
+        FROM candidates c
+        LEFT JOIN ticket t ON t.number_ticket = c.rowid
+        LEFT JOIN ticket_archive a ON a.number_ticket = c.rowid
+        ORDER BY c.rank, c.rowid DESC
+        LIMIT ? OFFSET ?
+    '''
+    rows = execute_query(query, (match, SEARCH_CANDIDATES, limit + 1, offset))
+    return rows[:limit], len(rows) > limit
+
+def rebuild_search_index() -> None:
+    """Перестраивает полнотекстовый индекс по таблицам ticket и ticket_archive."""
+    with transaction("rebuild_search_index") as conn:
+        conn.execute("INSERT INTO ticket_fts (ticket_fts) VALUES ('rebuild')")
+
 def update_ticket_comment(ticket_id: int, ticket_comm: str) -> bool:
     """Обновляет комментарий существующего тикета."""
-    execute_query("UPDATE ticket SET ticket_comm = ? WHERE number_ticket = ?", (ticket_comm, ticket_id))
+    owners = execute_query("UPDATE ticket SET ticket_comm = ? WHERE number_ticket = ? RETURNING tg_id_ticket",
+                           (ticket_comm, ticket_id))
+    for (tg_id,) in owners:
+        bump_data_version(tg_id)
     return True
 
 def read_ticket_comment(ticket_id: int) -> str | None:
     """Читает комментарий существующего тикета."""
-    row = execute_query("SELECT ticket_comm FROM ticket WHERE number_ticket = ?", (ticket_id,), fetch_one=True)
-    return row[0] if row else None
\ No newline at end of file
+    row = execute_query("SELECT ticket_comm FROM ticket_all WHERE number_ticket = ?", (ticket_id,), fetch_one=True)
+    return row[0] if row else None
+
+def _add_attachments(conn: sqlite3.Connection, ticket_id: int, attachments: Iterable[Attachment]) -> None:
+    now = int(time.time())
+    # Файл, который уже есть в хранилище (то же содержимое), повторно не скачивается
+    conn.executemany(
+        '''INSERT INTO ticket_attachments (ticket_id, kind, file_id, file_unique_id, file_name, mime_type, file_size,
+                                           stored_path, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?,
+                   (SELECT stored_path FROM ticket_attachments WHERE file_unique_id = ? AND stored_path IS NOT NULL LIMIT 1),
+                   ?)''',
+        [(ticket_id, *attachment, attachment[2], now) for attachment in attachments]
+    )
+
+def get_ticket_attachments(ticket_id: int) -> list[tuple[int, str, str, str, str | None, str | None]]:
+    """Возвращает вложения тикета: (id, вид, file_id, file_unique_id, имя файла, путь в хранилище)."""
+    query = '''SELECT id, kind, file_id, file_unique_id, file_name, stored_path FROM ticket_attachments
+               WHERE ticket_id = ? ORDER BY id'''
+    return execute_query(query, (ticket_id,))
+
+def get_unstored_attachments(limit: int = 20) -> list[tuple[int, str, str, int | None]]:
+    """Возвращает вложения, которые еще не скачаны в хранилище: (id, file_id, file_unique_id, размер)."""
+    query = '''SELECT id, file_id, file_unique_id, file_size FROM ticket_attachments
+               WHERE stored_path IS NULL AND store_error IS NULL ORDER BY id LIMIT ?'''
+    return execute_query(query, (limit,))
+
+def set_attachment_stored(file_unique_id: str, stored_path: str) -> None:
+    """Записывает путь к скачанному файлу для всех вложений с тем же содержимым."""
+    execute_query("UPDATE ticket_attachments SET stored_path = ? WHERE file_unique_id = ?", (stored_path, file_unique_id))
+
+def set_attachment_error(attachment_id: int, error: str) -> None:
+    """Отмечает вложение, которое не удалось скачать (например, файл больше лимита Bot API)."""
+    execute_query("UPDATE ticket_attachments SET store_error = ? WHERE id = ?", (error[:500], attachment_id))
+
+def _enqueue_notifications(conn: sqlite3.Connection, notifications: Iterable[Notification]) -> None:
+    now = int(time.time())
+    conn.executemany(
+        "INSERT INTO outbox (chat_id, method, payload, created_at, available_at) VALUES (?, ?, ?, ?, ?)",
+        [(payload['chat_id'], method, json.dumps(payload, ensure_ascii=False), now, now)
+         for method, payload in notifications]
+    )
+
+def get_pending_notifications(limit: int = 50) -> list[tuple[int, str, dict, int]]:
+    """Возвращает готовые к отправке уведомления в порядке создания: (id, метод, параметры, попыток)."""
+    rows = execute_query(
+        "SELECT id, method, payload, attempts FROM outbox WHERE status = 'pending' AND available_at <= ? ORDER BY id LIMIT ?",
+        (int(time.time()), limit)
+    )
+    return [(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+
+def mark_notifications_sent(ids: Iterable[int]) -> None:
+    """Отмечает уведомления доставленными."""
+    now = int(time.time())
+    with transaction("mark_notifications_sent") as conn:
+        conn.executemany("UPDATE outbox SET status = 'sent', sent_at = ? WHERE id = ?", [(now, id_) for id_ in ids])
+
+def reschedule_notification(notification_id: int, delay: int, error: str) -> None:
+    """Откладывает повторную отправку уведомления на delay секунд."""
+    execute_query("UPDATE outbox SET attempts = attempts + 1, available_at = ?, error = ? WHERE id = ?",
+                  (int(time.time()) + delay, error, notification_id))
+
+def mark_notification_failed(notification_id: int, error: str) -> None:
+    """Отмечает уведомление как неотправляемое (например, пользователь заблокировал бота)."""
+    execute_query("UPDATE outbox SET status = 'failed', attempts = attempts + 1, error = ? WHERE id = ?",
+                  (error, notification_id))
+
+def purge_sent_notifications(older_than: int) -> None:
+    """Удаляет доставленные уведомления старше older_than секунд."""
+    execute_query("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (int(time.time()) - older_than,))
+
+def get_fsm_record(key: str) -> tuple[str | None, dict] | None:
+    """Возвращает состояние FSM и его данные по ключу хранилища или None, если записи нет."""
+    row = execute_query("SELECT state, data FROM fsm_storage WHERE key = ?", (key,), fetch_one=True)
+    return (row[0], json.loads(row[1])) if row else None
+
+def save_fsm_records(records: Iterable[tuple[str, str | None, dict]]) -> None:
+    """Сохраняет пачку записей FSM (ключ, состояние, данные) одной транзакцией. Пустые записи удаляются."""
+    now = int(time.time())
+    upserts, deletes = [], []
+    for key, state, data in records:
+        if state is None and not data:
+            deletes.append((key,))
+        else:
+            upserts.append((key, state, json.dumps(data, ensure_ascii=False, default=str), now))
+    with transaction("save_fsm_records") as conn:
+        conn.executemany('''
+            INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+        ''', upserts)
+        conn.executemany("DELETE FROM fsm_storage WHERE key = ?", deletes)
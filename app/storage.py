@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app import db
+
+class _Record:
+    __slots__ = ('state', 'data')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None) -> None:
+        self.state = state
+        self.data = data or {}
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_storage с кэшем в памяти и отложенной записью.
+    Чтение идет из кэша (с подгрузкой из базы при промахе), изменения копятся и сбрасываются
+    в базу пачкой раз в flush_interval секунд и при закрытии хранилища.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, cache_size: int = 10000) -> None:
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._records: OrderedDict[StorageKey, _Record] = OrderedDict()
+        self._dirty: set[StorageKey] = set()
+        self._flush_task: asyncio.Task | None = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _record(self, key: StorageKey) -> _Record:
+        record = self._records.get(key)
+        if record is None:
+            row = await db.get_fsm_record(self._key(key))
+            # Пока шел запрос, запись могла появиться из другого обработчика — она свежее
+            record = self._records.get(key)
+            if record is None:
+                record = _Record(*row) if row else _Record()
+                self._records[key] = record
+        self._records.move_to_end(key)
+        self._evict()
+        return record
+
+    def _evict(self) -> None:
+        # Вытесняются только записи, уже сохраненные в базе
+        excess = len(self._records) - self.cache_size
+        if excess <= 0:
+            return
+        for key in [key for key in self._records if key not in self._dirty][:excess]:
+            del self._records[key]
+
+    def _mark_dirty(self, key: StorageKey) -> None:
+        self._dirty.add(key)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record = await self._record(key)
+        if record.state != state:
+            record.state = state
+            self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        if record.data != data:
+            record.data = data.copy()
+            self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def flush(self) -> None:
+        """Записывает в базу все накопленные изменения."""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        batch = []
+        for key in keys:
+            record = self._records[key]
+            batch.append((self._key(key), record.state, record.data.copy()))
+        try:
+            await db.save_fsm_records(batch)
+        except Exception:
+            # Изменения не потеряны: ключи вернутся в очередь на запись
+            self._dirty |= keys
+            raise
+
+    async def _flush_loop(self) -> None:
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Ошибка записи состояний FSM")
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
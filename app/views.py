@@ -0,0 +1,378 @@
+import functools
+import html
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from app import db, sql
+from app.lifecycle import TicketChange
+from app.callbacks import (AdminOrgCallback, AdminPageCallback, HistoryPageCallback, SearchPageCallback,
+                           TicketCallback)
+import config
+
+# Текст и клавиатура экрана бота
+View = tuple[str, InlineKeyboardMarkup]
+
+def _keyboard(*rows: list[tuple[str, str]]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=data) for text, data in row] for row in rows
+    ])
+
+# Статические клавиатуры строятся один раз при импорте и переиспользуются во всех ответах
+WELCOME_KEYBOARD = _keyboard([("🏢 Моя компания", "my_company")])
+MAIN_MENU_KEYBOARD = _keyboard([("🏢 Моя компания", "my_company"), ("📥 Мои заявки", "my_ticket")],
+                               [("📤 Новая заявка", "new_ticket")])
+ADMIN_MAIN_MENU_KEYBOARD = _keyboard([("🏢 Моя компания", "my_company"), ("📥 Мои заявки", "my_ticket")],
+                                     [("📤 Новая заявка", "new_ticket")],
+                                     [("🤘 Тикет меню", "admin_panel")])
+BACK_TO_MAIN_MENU_KEYBOARD = _keyboard([("⬅️ Назад", "main_menu")])
+BACK_TO_COMPANY_KEYBOARD = _keyboard([("⬅️ Назад", "my_company")])
+BACK_TO_ADMIN_PANEL_KEYBOARD = _keyboard([("⬅️ Назад", "admin_panel")])
+MY_TICKET_KEYBOARD = _keyboard([("☑️ История заявок", "my_ticket_history")], [("⬅️ Назад", "main_menu")])
+DONE_TICKET_KEYBOARD = _keyboard([("🧑‍💻 Главное меню", "main_menu")])
+COMPLETED_USER_KEYBOARD = _keyboard([("☑️ История заявок", "my_ticket_history"), ("🧑‍💻 Главное меню", "main_menu")])
+COMPLETED_ADMIN_KEYBOARD = _keyboard([("🤘 Тикет меню", "admin_panel")])
+NEW_TICKET_ADMIN_KEYBOARD = _keyboard([("🤘 Тикет меню 🫰", "admin_panel")])
+
+WELCOME_TEXT = "Добро пожаловать в HelpDesk компании <b>ЭниКей</b>! Для работы в сервисе необходимо заполнить данные."
+
+NEW_TICKET_VIEW: View = (
+    f"<b>📤 Создание новой заявки</b>\n\n"
+    f" - 📝 Опишите вашу проблему.\n"
+    f" - 🧩 Пожалуйста, опишите вашу проблему и укажите как можно больше деталей.\n"
+    f" - 📎 К заявке можно приложить скриншот или документ (описание — в подписи к файлу).\n\n"
+    f"<b>Пример оформления заявки:</b>\n<i>Не работает принтер на 4 ПК, необходимо проверить подключение.</i>",
+    BACK_TO_MAIN_MENU_KEYBOARD,
+)
+EDIT_COMPANY_NAME_VIEW: View = (
+    "📋 Введите наименование организации.\nПример: <code>ООО РОГА И КОПЫТА</code>", BACK_TO_COMPANY_KEYBOARD)
+EDIT_COMPANY_ADDRESS_VIEW: View = (
+    "📍 Введите фактический адрес организации.\nПример: <code>г. Иваново, ул. Варенцовой, д. 33 оф. 1</code>",
+    BACK_TO_COMPANY_KEYBOARD)
+EDIT_COMPANY_INN_VIEW: View = ("📑 Введите ИНН организации.\nПример: <code>3700010101</code>", BACK_TO_COMPANY_KEYBOARD)
+EDIT_COMPANY_PHONE_VIEW: View = (
+    "☎️ Введите контактный номер телефона.\nПример: <code>+79109998188</code>", BACK_TO_COMPANY_KEYBOARD)
+
+# Память отрисованных экранов: (экран, tg_id) -> (момент отрисовки, версия данных пользователя, экран)
+_memo: OrderedDict[tuple[str, int], tuple[float, tuple[int, int], View]] = OrderedDict()
+_memo_stats = {'hits': 0, 'misses': 0}
+
+def _memo_enabled() -> bool:
+    # Тикеты пользователя меняет и администратор; при нескольких процессах это происходит
+    # в чужом процессе, и локальная версия данных об изменении не узнает
+    return config.VIEW_CACHE_ENABLED and config.WORKERS == 1
+
+def memoized(name: str) -> Callable[[Callable[[int], Awaitable[View]]], Callable[[int], Awaitable[View]]]:
+    """
+    Запоминает экран пользователя до изменения его данных (см. sql.bump_data_version), но не дольше
+    VIEW_CACHE_TTL секунд: изменения из других процессов (например, manage.py counters rebuild)
+    версию данных не меняют. Версия берется до чтения из базы: если запись произойдет во время отрисовки,
+    запомненный экран сразу окажется устаревшим и при следующем обращении будет построен заново.
+    """
+    def decorator(render: Callable[[int], Awaitable[View]]) -> Callable[[int], Awaitable[View]]:
+        @functools.wraps(render)
+        async def wrapper(tg_id: int) -> View:
+            if not _memo_enabled():
+                return await render(tg_id)
+            key = (name, tg_id)
+            version = sql.get_data_version(tg_id)
+            entry = _memo.get(key)
+            if entry is not None and entry[1] == version and time.monotonic() - entry[0] < config.VIEW_CACHE_TTL:
+                _memo.move_to_end(key)
+                _memo_stats['hits'] += 1
+                return entry[2]
+            _memo_stats['misses'] += 1
+            rendered_at = time.monotonic()
+            view = await render(tg_id)
+            _memo[key] = (rendered_at, version, view)
+            _memo.move_to_end(key)
+            while len(_memo) > config.VIEW_CACHE_SIZE:
+                _memo.popitem(last=False)
+            return view
+        return wrapper
+    return decorator
+
+def get_memo_stats() -> dict[str, int]:
+    """Возвращает число попаданий и промахов памяти экранов и ее текущий размер."""
+    return {**_memo_stats, 'size': len(_memo)}
+
+@memoized('main_menu')
+async def main_menu(tg_id: int) -> View:
+    totals = await db.get_ticket_status_totals(tg_id)
+    open_ticket = totals.get("В работе", 0)
+    closed_ticket = totals.get("Завершена", 0)
+    user = await db.get_user_by_id(tg_id)
+    organization = user.get("organization", "Нет данных")
+    organization_phone = user.get("organization_phone", "Нет данных")
+
+    text = (
+        f"<b>🧑‍💻 Главное меню</b>\n\n"
+        f"<b>📋 Компания:</b> {organization}\n"
+        f"<b>☎️ Контактный номер:</b> {organization_phone}\n\n"
+        f"<b>📬 Открытых заявок:</b> {open_ticket}\n"
+        f"<b>📭 Закрытых заявок:</b> {closed_ticket}\n"
+        f"\nВыберите интересующее действие ⬇️"
+    )
+    keyboard = ADMIN_MAIN_MENU_KEYBOARD if tg_id in config.ADMIN_USERS else MAIN_MENU_KEYBOARD
+    return text, keyboard
+
+def new_ticket(tg_id: int) -> View:
+    return NEW_TICKET_VIEW
+
+@memoized('my_ticket')
+async def my_ticket(tg_id: int) -> View:
+    user = await db.get_user_by_id(tg_id)
+    user_tickets_in_progress = await db.get_tickets_in_progress_by_user_id(tg_id)
+    total_user_tickets_in_progress = len(user_tickets_in_progress)
+    open_ticket = str(total_user_tickets_in_progress) if total_user_tickets_in_progress else "0"
+    organization = user.get("organization", "Нет данных")
+    organization_address = user.get("organization_adress", "Нет данных")
+
+    if user_tickets_in_progress:
+        text = (
+            f"<b>📥 Мои заявки в работе</b>\n\n"
+            f"<b>Компания:</b> {organization}\n"
+            f"<b>Адрес заявки:</b> {organization_address}\n"
+            f"<b>Заявок в работе:</b> {open_ticket}\n\n"
+        )
+        for ticket in user_tickets_in_progress:
+            text += (
+                f"<b>Номер заявки:</b> <code>#{ticket[0]}</code>\n"
+                f"<b>Описание:</b> {ticket[4]}\n"
+                f"<b>Дата:</b> {ticket[5]}\n"
+                f"<b>Статус:</b> {ticket[6]}\n"
+            )
+    else:
+        text = (
+            '<b>📥 Мои заявки</b>\n\n'
+            'У вас пока нет заявок в работе.. 🤷‍♂️\n'
+            '- <i>Чтобы оставить заявку, воспользуйтесь меню </i><b>"📤 Новая заявка"</b>'
+        )
+    return text, MY_TICKET_KEYBOARD
+
+async def my_ticket_history(tg_id: int, page: int = 1, after: int | None = None, before: int | None = None,
+                            page_size: int = 4) -> View:
+    current_page_tickets, has_prev, has_next = await db.get_completed_tickets_page(tg_id, after, before, page_size)
+    if current_page_tickets:
+        if has_prev or has_next:
+            text = f"<b>📨 История ваших завершенных заявок (страница {page}):</b>\n\n"
+        else:
+            text = "<b>📨 История ваших завершенных заявок:</b>\n\n"
+
+        for ticket in current_page_tickets:
+            text += (
+                f"✅\n"
+                f"<b>├ Номер заявки:</b> <code>#{ticket[0]}</code>\n"
+                f"<b>├ Время создания:</b> {ticket[5]}\n"
+                f"<b>├ Сообщение:</b> - <em>{ticket[4]}</em>\n"
+                f"<b>└ Комментарий исполнителя:</b> - <em>{ticket[7]}</em>\n\n"
+            )
+    else:
+        text = "🤷‍♂️ Упс.. У вас нет истории заявок."
+
+    keyboard_buttons = []
+    if current_page_tickets:
+        # В callback передается номер страницы и граничный номер тикета: следующая страница
+        # читается по индексу от этого номера, без выборки всей истории
+        nav_buttons = []
+        if has_prev:
+            nav_buttons.append(InlineKeyboardButton(text="🔙 Предыдущая", callback_data=HistoryPageCallback(page=page - 1, before=current_page_tickets[0][0]).pack()))
+        if has_next:
+            nav_buttons.append(InlineKeyboardButton(text="🔜 Следующая", callback_data=HistoryPageCallback(page=page + 1, after=current_page_tickets[-1][0]).pack()))
+        if nav_buttons:
+            keyboard_buttons.append(nav_buttons)
+
+    keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="my_ticket")])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    return text, keyboard
+
+def _company_keyboard(organization: bool, address: bool, inn: bool, phone: bool) -> InlineKeyboardMarkup:
+    mark = lambda filled: '✅' if filled else '❌'
+    return _keyboard([(f"{mark(organization)} Наименование компании", "edit_company_name")],
+                     [(f"{mark(address)} Фактический адрес", "edit_company_adress")],
+                     [(f"{mark(inn)} ИНН", "edit_company_inn")],
+                     [(f"{mark(phone)} Контактный номер", "edit_company_phone")],
+                     [("⬅️ В меню", "main_menu")])
+
+# Клавиатура «Моя компания» зависит только от того, какие поля заполнены: все 16 вариантов строятся заранее
+COMPANY_KEYBOARDS = {
+    (organization, address, inn, phone): _company_keyboard(organization, address, inn, phone)
+    for organization in (False, True) for address in (False, True)
+    for inn in (False, True) for phone in (False, True)
+}
+
+@memoized('my_company')
+async def my_company(tg_id: int) -> View:
+    user = await db.get_user_by_id(tg_id)
+    organization = user.get("organization", "Нет данных")
+    organization_address = user.get("organization_adress", "Нет данных")
+    organization_inn = user.get("organization_inn", "Нет данных")
+    organization_phone = user.get("organization_phone", "Нет данных")
+
+    text = (
+        f"<b>🏢 Информация о компании</b>\n\n"
+        f"<b>📋 Компания:</b> {organization}\n"
+        f"<b>📍 Адрес:</b> {organization_address}\n"
+        f"<b>📑 ИНН:</b> {organization_inn}\n"
+        f"<b>☎️ Контактный номер:</b> <i>{organization_phone}</i>\n\n"
+        f"<b>ЗАПОЛНИТЬ ДАННЫЕ О КОМПАНИИ ⬇️</b>"
+    )
+    keyboard = COMPANY_KEYBOARDS[(organization != 'Нет данных', organization_address != 'Нет данных',
+                                  organization_inn != 'Нет данных', organization_phone != 'Нет данных')]
+    return text, keyboard
+
+def edit_company_name(tg_id: int) -> View:
+    return EDIT_COMPANY_NAME_VIEW
+
+def edit_company_address(tg_id: int) -> View:
+    return EDIT_COMPANY_ADDRESS_VIEW
+
+def edit_company_inn(tg_id: int) -> View:
+    return EDIT_COMPANY_INN_VIEW
+
+def edit_company_phone(tg_id: int) -> View:
+    return EDIT_COMPANY_PHONE_VIEW
+
+def done_ticket(ticket_id: int) -> View:
+    text = (
+        f'🎉🥳 Успех, ваша заявка зарегистрирована!\n\n'
+        f'<b>Номер заявки:</b> <code>#{ticket_id}</code>.\n\n'
+        f'<i>PS: Отслеживайте статус поставленных задач в разделе</i> <b>"📥 Мои заявки"</b>'
+    )
+    return text, DONE_TICKET_KEYBOARD
+
+def ticket_completed(change: TicketChange) -> str:
+    """Текст о завершении тикета — одинаковый для пользователя и администратора."""
+    seconds = change.resolution_seconds
+    if seconds is None:
+        # У старых строк нет created_at — время создания берется из текста даты
+        seconds = change.closed_at - (sql.from_moscow_text(change.time_ticket) or change.closed_at)
+    hours = seconds // 3600
+    return (
+        f"🎉 Задача <code>#{change.number}</code> выполнена!\n"
+        f"<b>Время выполнения:</b> {hours} часа(ов).\n\n"
+        f"<b>Ответ исполнителя:</b> - <em>{change.comment}</em>\n\n"
+        f"<em>⚠️ Пожалуйста, проверьте корректность исполнения задачи.</em>"
+    )
+
+# Названия событий ticket_events для карточки тикета
+EVENT_TITLES = {'close': "завершена"}
+
+def ticket_events(events: list[tuple]) -> str:
+    """Текст истории смены статусов тикета для карточки администратора (пустой, если событий нет)."""
+    if not events:
+        return ""
+    lines = []
+    for event, _, _, actor, created_at in events:
+        line = f"• {sql.to_moscow_text(created_at)} — {EVENT_TITLES.get(event, event)}"
+        if actor is not None:
+            line += f" (<a href='tg://user?id={actor}'>{actor}</a>)"
+        lines.append(line)
+    return "<b>🕓 История:</b>\n" + "\n".join(lines) + "\n\n"
+
+async def admin_panel(organization: str | None = None, newest_first: bool = False, page: int = 1,
+                      after: int | None = None, before: int | None = None, page_size: int = 8) -> View:
+    totals = await db.get_ticket_status_totals()
+    total_open_tickets = totals.get("В работе", 0)
+    total_closed_tickets = totals.get("Завершена", 0)
+    tickets_in_progress, has_prev, has_next = await db.get_open_tickets_page(organization, after, before, page_size, newest_first)
+    if not tickets_in_progress and (after is not None or before is not None):
+        # Тикеты за границей страницы успели закрыть — показываем первую страницу
+        page = 1
+        tickets_in_progress, has_prev, has_next = await db.get_open_tickets_page(organization, None, None, page_size, newest_first)
+
+    text = (
+        f"<b>🤘 Тикет меню 💲</b>\n\n"
+        f"<b>🔥 Заявок в работе:</b> {total_open_tickets}\n"
+        f"<b>👍 Завершенных заявок:</b> {total_closed_tickets}\n\n"
+    )
+    if organization is not None:
+        text += f"<b>🏢 Организация:</b> {organization}\n"
+    if has_prev or has_next:
+        text += f"<b>📄 Страница:</b> {page}\n"
+    text += f"\n<b>⚠️ Внимание!</b> <i>Закрытые задачи не могут быть возвращены в работу. Пожалуйста, будьте внимательны при их закрытии!</i>"
+
+    keyboard_buttons = []
+    for ticket in tickets_in_progress:
+        ticket_info = f"Заявка #{ticket[0]} - {ticket[5]}"
+        keyboard_buttons.append([InlineKeyboardButton(text=ticket_info, callback_data=TicketCallback(id=ticket[0]).pack())])
+
+    if tickets_in_progress:
+        nav_buttons = []
+        if has_prev:
+            nav_buttons.append(InlineKeyboardButton(text="🔙 Предыдущая", callback_data=AdminPageCallback(page=page - 1, before=tickets_in_progress[0][0]).pack()))
+        if has_next:
+            nav_buttons.append(InlineKeyboardButton(text="🔜 Следующая", callback_data=AdminPageCallback(page=page + 1, after=tickets_in_progress[-1][0]).pack()))
+        if nav_buttons:
+            keyboard_buttons.append(nav_buttons)
+
+    keyboard_buttons.append([
+        InlineKeyboardButton(text="🔃 Сначала старые" if newest_first else "🔃 Сначала новые", callback_data="admin_sort"),
+        InlineKeyboardButton(text="🏢 Фильтр", callback_data="admin_filter")
+    ])
+    keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    return text, keyboard
+
+async def admin_filter(organization: str | None = None) -> tuple[str, InlineKeyboardMarkup, list[str]]:
+    organizations = await db.get_open_ticket_organizations()
+    text = (
+        f"<b>🏢 Фильтр по организации</b>\n\n"
+        f"Выберите организацию, заявки которой нужно показать ⬇️"
+    )
+    keyboard_buttons = []
+    for index, (name, count) in enumerate(organizations):
+        mark = "✅ " if name == organization else ""
+        keyboard_buttons.append([InlineKeyboardButton(text=f"{mark}{name} ({count})", callback_data=AdminOrgCallback(index=index).pack())])
+    keyboard_buttons.append([InlineKeyboardButton(text="📋 Все организации", callback_data=AdminOrgCallback().pack())])
+    keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel")])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    return text, keyboard, [name for name, _ in organizations]
+
+def highlight(text: str, query: str, width: int = 12) -> str:
+    """
+    Возвращает фрагмент текста (до width слов) вокруг первого найденного слова запроса
+    с выделенными словами. Слово считается найденным, если начинается с одного из слов запроса.
+    """
+    prefixes = tuple(word.casefold() for word in re.findall(r"\w+", query))
+    words = text.split()
+    found = [index for index, word in enumerate(words) if re.sub(r"^\W+", "", word).casefold().startswith(prefixes)]
+    start = max(0, found[0] - width // 3) if found else 0
+    marked = set(found)
+    fragment = []
+    for index in range(start, min(len(words), start + width)):
+        word = html.escape(words[index])
+        fragment.append(f"<b>{word}</b>" if index in marked else word)
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if start + width < len(words) else ""
+    return prefix + " ".join(fragment) + suffix
+
+async def search_results(query: str, page: int = 1, page_size: int = 5) -> View:
+    rows, has_next = await db.search_tickets(query, (page - 1) * page_size, page_size)
+    if not rows:
+        text = f"🔎 По запросу <b>{html.escape(query)}</b> ничего не найдено."
+    else:
+        text = f"<b>🔎 Результаты поиска:</b> {html.escape(query)}\n"
+        if page > 1 or has_next:
+            text += f"<b>📄 Страница:</b> {page}\n"
+        text += "\n"
+        for number, organization, time_ticket, state, message_ticket, ticket_comm in rows:
+            text += f"<b>#{number}</b> · {organization} · {time_ticket} · {state}\n"
+            text += f"<i>{highlight(message_ticket or '', query)}</i>\n"
+            if ticket_comm:
+                text += f"💬 <i>{highlight(ticket_comm, query)}</i>\n"
+            text += "\n"
+
+    keyboard_buttons = [[InlineKeyboardButton(text=f"Заявка #{row[0]}", callback_data=TicketCallback(id=row[0]).pack())] for row in rows]
+    nav_buttons = []
+    if page > 1:
+        nav_buttons.append(InlineKeyboardButton(text="🔙 Предыдущая", callback_data=SearchPageCallback(page=page - 1).pack()))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton(text="🔜 Следующая", callback_data=SearchPageCallback(page=page + 1).pack()))
+    if nav_buttons:
+        keyboard_buttons.append(nav_buttons)
+    keyboard_buttons.append([InlineKeyboardButton(text="🤘 Тикет меню", callback_data="admin_panel")])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
@@ -0,0 +1,90 @@
+import asyncio
+import hmac
+import logging
+import re
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Допустимый секрет вебхука по документации Bot API
+SECRET_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+def create_app(process: Callable[[dict], Awaitable], path: str = "/webhook", secret: str = "",
+               queue_size: int = 1000, workers: int = 8) -> web.Application:
+    """
+    Создает aiohttp-приложение, принимающее обновления Telegram на path и передающее их в process.
+    Запрос подтверждается сразу после постановки обновления в очередь; обработку ведут
+    фоновые задачи, поэтому медленный обработчик не задерживает ответ Telegram.
+    При переполнении очереди возвращается 503, и Telegram повторит доставку позже.
+    Запросы без верного секрета в заголовке X-Telegram-Bot-Api-Secret-Token отклоняются;
+    без секрета вебхук не запускается — иначе любой, кто достучится до порта, мог бы прислать
+    обновление от имени администратора.
+    """
+    if not SECRET_PATTERN.fullmatch(secret):
+        raise ValueError("WEBHOOK_SECRET должен быть задан: 1–256 символов A-Z, a-z, 0-9, _ и -")
+    expected = secret.encode()
+    queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+    tasks: list[asyncio.Task] = []
+
+    async def handle_update(request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "").encode(errors="surrogateescape")
+        if not hmac.compare_digest(received, expected):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logging.warning("Очередь обновлений переполнена, обновление %s отклонено", update.get("update_id"))
+            return web.Response(status=503)
+        return web.Response()
+
+    async def worker() -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await process(update)
+            except Exception:
+                logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+            finally:
+                queue.task_done()
+
+    async def on_startup(app: web.Application) -> None:
+        tasks.extend(asyncio.create_task(worker()) for _ in range(workers))
+
+    async def on_cleanup(app: web.Application) -> None:
+        # Даем обработать уже принятые обновления, прежде чем остановить обработчики
+        try:
+            await asyncio.wait_for(queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logging.warning("Остановка с необработанными обновлениями: %s", queue.qsize())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+async def run(bot: Bot, process: Callable[[dict], Awaitable], url: str, path: str, secret: str,
+              host: str, port: int, queue_size: int, workers: int, allowed_updates: list[str]) -> None:
+    """Регистрирует вебхук в Telegram (если задан url) и обслуживает обновления до отмены задачи."""
+    app = create_app(process, path, secret, queue_size, workers)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Вебхук слушает %s:%s%s", host, port, path)
+    if url:
+        await bot.set_webhook(url.rstrip("/") + path, secret_token=secret,
+                              allowed_updates=allowed_updates)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
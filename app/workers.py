@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+
+def update_user_id(update: dict) -> int:
+    """Возвращает Telegram ID пользователя, от которого пришло обновление (0, если его нет)."""
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user') or value.get('chat')
+        if isinstance(sender, dict) and 'id' in sender:
+            return sender['id']
+    return 0
+
+class Supervisor:
+    """
+    Получает обновления один раз и раздает их процессам-обработчикам по Telegram ID пользователя.
+    Все обновления одного пользователя попадают в один процесс, поэтому их порядок, состояние FSM
+    и кэш профиля остаются локальными для этого процесса.
+    """
+
+    def __init__(self, target: Callable[[int, int, multiprocessing.Queue], None], count: int,
+                 queue_size: int = 1000) -> None:
+        self.target = target
+        self.count = count
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(count)]
+        self._processes: list[multiprocessing.Process | None] = [None] * count
+
+    def _start_process(self, index: int) -> None:
+        process = self._context.Process(target=self.target, args=(index, self.count, self._queues[index]),
+                                        name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        self._processes[index] = process
+        logging.info("Запущен обработчик %s (pid %s)", index, process.pid)
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self._start_process(index)
+
+    async def route(self, update: dict) -> None:
+        """Передает обновление процессу, отвечающему за пользователя."""
+        user_id = update_user_id(update)
+        index = user_id % self.count
+        process = self._processes[index]
+        if process is not None and not process.is_alive():
+            logging.error("Обработчик %s завершился с кодом %s, перезапуск", index, process.exitcode)
+            self._start_process(index)
+        while True:
+            try:
+                self._queues[index].put_nowait((user_id, update))
+                return
+            except queue_module.Full:
+                # Обработчик не успевает — притормаживаем прием обновлений, не блокируя цикл событий
+                await asyncio.sleep(0.05)
+
+    async def poll(self, bot: Bot, allowed_updates: list[str], timeout: int = 30) -> None:
+        """Получает обновления long polling'ом и раздает их обработчикам до отмены задачи."""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                                request_timeout=timeout + 10)
+            except Exception:
+                logging.exception("Ошибка получения обновлений")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await self.route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Просит обработчики завершиться после разбора очереди и дожидается их остановки."""
+        loop = asyncio.get_running_loop()
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning("Обработчик %s не завершился вовремя, принудительная остановка", process.name)
+                process.terminate()
+
+async def serve(bot: Bot, dp: Dispatcher, queue: multiprocessing.Queue, lanes: int = 16) -> None:
+    """
+    Обрабатывает обновления, полученные от Supervisor, внутри процесса-обработчика.
+    Обновления распределяются по lanes очередям по ID пользователя: разные пользователи
+    обрабатываются параллельно, обновления одного пользователя — строго по порядку.
+    """
+    loop = asyncio.get_running_loop()
+    lane_queues: list[asyncio.Queue] = [asyncio.Queue() for _ in range(lanes)]
+
+    async def lane(lane_queue: asyncio.Queue) -> None:
+        while True:
+            update = await lane_queue.get()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception:
+                logging.exception("Ошибка обработки обновления %s", update.get('update_id'))
+            finally:
+                lane_queue.task_done()
+
+    tasks = [asyncio.create_task(lane(lane_queue)) for lane_queue in lane_queues]
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            user_id, update = item
+            lane_queues[user_id % lanes].put_nowait(update)
+        for lane_queue in lane_queues:
+            await lane_queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,272 @@
+"""
+Нагрузочный тест бота: сгенерированные обновления подаются в dp.feed_update, запросы к Telegram
+перехватывает заглушка сессии (без сети), данные пишутся во временную базу.
+Для каждого сценария выводится пропускная способность и задержка обработки (p50/p95/p99).
+
+    python bench/load_test.py --users 200 --concurrency 50 --json result.json
+    python bench/load_test.py --compare result.json   # сравнить с сохраненным прогоном
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from app import sql
+from app.callbacks import CompleteCallback, HistoryPageCallback, TicketCallback
+
+# Сценарии по порядку запуска; каждый пользователь проходит свою последовательность обновлений по порядку,
+# разные пользователи — параллельно
+SCENARIOS = ('start', 'new_ticket', 'menu', 'history', 'admin_complete')
+
+# Диапазоны Telegram ID синтетических пользователей и администраторов
+USER_BASE = 7_000_000_000
+ADMIN_BASE = 8_000_000_000
+
+class StubSession(BaseSession):
+    """Сессия Bot API без сети: запоминает число запросов и возвращает правдоподобные ответы."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.requests: dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    async def close(self) -> None:
+        pass
+
+    async def make_request(self, bot: Any, method: TelegramMethod, timeout: int | None = None) -> Any:
+        self.requests[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        returning = method.__returning__
+        if returning is bool or bool in getattr(returning, '__args__', ()):
+            return True
+        chat_id = getattr(method, 'chat_id', None) or 1
+        return Message(message_id=next(self._message_ids), date=datetime.datetime.now(datetime.timezone.utc),
+                       chat=Chat(id=chat_id, type='private'), text=getattr(method, 'text', None))
+
+    async def stream_content(self, *args: Any, **kwargs: Any):
+        yield b''
+
+class Updates:
+    """Фабрика синтетических обновлений с последовательными номерами."""
+
+    def __init__(self) -> None:
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(tg_id: int) -> User:
+        return User(id=tg_id, is_bot=False, first_name='Bench', username=f'bench{tg_id}')
+
+    def message(self, tg_id: int, text: str) -> Update:
+        message = Message(message_id=next(self._message_ids), date=datetime.datetime.now(datetime.timezone.utc),
+                          chat=Chat(id=tg_id, type='private'), from_user=self._user(tg_id), text=text)
+        return Update(update_id=next(self._update_ids), message=message)
+
+    def callback(self, tg_id: int, data: str) -> Update:
+        message = Message(message_id=next(self._message_ids), date=datetime.datetime.now(datetime.timezone.utc),
+                          chat=Chat(id=tg_id, type='private'), from_user=self._user(tg_id), text='…')
+        query = CallbackQuery(id=str(next(self._update_ids)), from_user=self._user(tg_id), chat_instance='bench',
+                              message=message, data=data)
+        return Update(update_id=next(self._update_ids), callback_query=query)
+
+def seed(users: int, completed: int, open_tickets: int, rng: random.Random) -> dict[int, list[int]]:
+    """Заполняет базу пользователями и тикетами. Возвращает номера завершенных тикетов каждого пользователя."""
+    history: dict[int, list[int]] = {}
+    now = int(time.time())
+    with sql.transaction() as conn:
+        for index in range(users):
+            tg_id = USER_BASE + index
+            organization = f"ООО Нагрузка {index % 50}"
+            conn.execute('''INSERT INTO users (tg_id, data_reg, organization, organization_adress, organization_inn,
+                                               organization_phone, history_ticket, data_ticket, user_name, registered_at)
+                            VALUES (?, ?, ?, 'г. Иваново', '3700010101', '+79990000000', '', '', ?, ?)''',
+                         (tg_id, sql.to_moscow_text(now - 90 * 86400), organization, f'bench{tg_id}', now - 90 * 86400))
+            history[tg_id] = []
+            for number in range(completed + open_tickets):
+                created_at = now - rng.randint(3600, 60 * 86400)
+                state = "Завершена" if number < completed else "В работе"
+                cursor = conn.execute('''
+                    INSERT INTO ticket (tg_id_ticket, organization, addres_ticket, message_ticket, time_ticket,
+                                        state_ticket, ticket_comm, created_at, closed_at)
+                    VALUES (?, ?, 'г. Иваново', ?, ?, ?, ?, ?, ?)
+                ''', (tg_id, organization, f"Не работает принтер №{number}", sql.to_moscow_text(created_at), state,
+                      "Заменили картридж" if state == "Завершена" else "", created_at,
+                      created_at + rng.randint(600, 86400) if state == "Завершена" else None))
+                if state == "Завершена":
+                    history[tg_id].append(cursor.lastrowid)
+    return history
+
+def build_scenarios(updates: Updates, users: int, admins: int, history: dict[int, list[int]],
+                    open_by_user: dict[int, list[int]]) -> dict[str, list[list[Update]]]:
+    """Возвращает для каждого сценария последовательности обновлений по пользователям."""
+    seeded = [USER_BASE + index for index in range(users)]
+    fresh = [USER_BASE + users + index for index in range(users)]
+    scenarios: dict[str, list[list[Update]]] = {}
+    # Регистрация нового пользователя и повторный /start зарегистрированного
+    scenarios['start'] = [[updates.message(tg_id, '/start'), updates.message(tg_id, '/start')] for tg_id in fresh]
+    scenarios['new_ticket'] = [
+        [updates.callback(tg_id, 'new_ticket'), updates.message(tg_id, 'Не печатает принтер в бухгалтерии'),
+         updates.callback(tg_id, 'main_menu')]
+        for tg_id in seeded
+    ]
+    scenarios['menu'] = [
+        [updates.callback(tg_id, data) for data in ('main_menu', 'my_company', 'main_menu', 'my_ticket', 'main_menu')]
+        for tg_id in seeded
+    ]
+    # Первые страницы истории и листание вперед по номеру последнего тикета страницы (как кнопки бота)
+    scenarios['history'] = []
+    for tg_id in seeded:
+        sequence = [updates.callback(tg_id, 'my_ticket_history')]
+        ids = history[tg_id]
+        for page in range(2, (len(ids) + 3) // 4 + 1):
+            sequence.append(updates.callback(tg_id, HistoryPageCallback(page=page, after=ids[(page - 1) * 4 - 1]).pack()))
+        scenarios['history'].append(sequence)
+    # Каждый администратор открывает тикет, пишет комментарий и завершает его
+    open_tickets = [ticket_id for tickets in open_by_user.values() for ticket_id in tickets]
+    scenarios['admin_complete'] = []
+    for index in range(admins):
+        tg_id = ADMIN_BASE + index
+        sequence = [updates.callback(tg_id, 'admin_panel')]
+        for ticket_id in open_tickets[index::admins]:
+            sequence += [updates.callback(tg_id, TicketCallback(id=ticket_id).pack()), updates.message(tg_id, 'Выполнено'),
+                         updates.callback(tg_id, CompleteCallback(id=ticket_id).pack())]
+        scenarios['admin_complete'].append(sequence)
+    return scenarios
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+async def run_scenario(feed: Callable[[Update], Any], sequences: list[list[Update]], concurrency: int) -> dict[str, float]:
+    """Прогоняет последовательности параллельно (не более concurrency пользователей сразу) и собирает задержки."""
+    latencies: list[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def user(sequence: list[Update]) -> None:
+        nonlocal errors
+        async with semaphore:
+            for update in sequence:
+                started = time.perf_counter()
+                try:
+                    await feed(update)
+                except Exception:
+                    errors += 1
+                    logging.exception("Ошибка обработки обновления %s", update.update_id)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(sequence) for sequence in sequences))
+    elapsed = time.perf_counter() - started
+    return {
+        'updates': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def print_results(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]] | None) -> None:
+    header = f"{'сценарий':<16}{'обновл.':>9}{'ошибки':>8}{'обн/с':>10}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print(f"{name:<16}{result['updates']:>9}{result['errors']:>8}{result['throughput']:>10}"
+              f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}")
+        if baseline and name in baseline:
+            base = baseline[name]
+            deltas = []
+            for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if base.get(key):
+                    deltas.append(f"{key} {(result[key] - base[key]) / base[key] * 100:+.0f}%")
+            print(f"{'':<16}к базовому прогону: {', '.join(deltas)}")
+
+async def main(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix='bot-bench-')
+    sql.DB_PATH = os.path.join(directory, 'bench.db')
+
+    # main импортируется после подмены пути к базе: при импорте он создает таблицы
+    import config
+    import main as bot_main
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+    config.ADMIN_USERS.extend(ADMIN_BASE + index for index in range(args.admins))
+
+    session = StubSession(args.api_latency / 1000)
+    bot_main.bot.session = session
+    if not args.real_limits:
+        # Лимиты Telegram измеряли бы очередь отправки, а не обработку обновлений
+        bot_main.sender.chat_rate = bot_main.sender.group_rate = 1e9
+        bot_main.sender.burst = 1e9
+        bot_main.sender.set_global_rate(1e9)
+
+    history = seed(args.users, args.history, args.open, rng)
+    open_by_user = {
+        tg_id: [row[0] for row in sql.get_tickets_in_progress_by_user_id(tg_id)] for tg_id in history
+    }
+    scenarios = build_scenarios(Updates(), args.users, args.admins, history, open_by_user)
+
+    outbox_task = asyncio.create_task(bot_main.outbox_dispatcher.run())
+    results = {}
+    try:
+        for name in args.scenarios:
+            results[name] = await run_scenario(lambda update: bot_main.dp.feed_update(bot_main.bot, update),
+                                               scenarios[name], args.concurrency)
+    finally:
+        outbox_task.cancel()
+        await bot_main.sender.stop()
+        await bot_main.storage.close()
+        await bot_main.db.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    logging.info("Запросов к Bot API: %s", dict(session.requests))
+    return results
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработки обновлений")
+    parser.add_argument('--users', type=int, default=200, help="число пользователей в каждом сценарии")
+    parser.add_argument('--admins', type=int, default=10, help="число администраторов, завершающих тикеты")
+    parser.add_argument('--concurrency', type=int, default=50, help="сколько пользователей работают одновременно")
+    parser.add_argument('--history', type=int, default=12, help="завершенных тикетов у каждого пользователя")
+    parser.add_argument('--open', type=int, default=2, help="открытых тикетов у каждого пользователя")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument('--real-limits', action='store_true', help="не снимать лимиты отправки Telegram")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1, help="зерно генератора данных")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--compare', help="сравнить с результатами из файла")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(main(arguments))
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
@@ -8,3 +8,70 @@ ADMIN_USERS = [1610295653]
 
 # ID для отправки уведомлений администраторам
 ADMIN_MESSAGE = 1610295653
+
+# Количество потоков для запросов к базе данных (в режиме WAL чтение идет параллельно с записью)
+DB_WORKERS = 4
+
+# Кэш профилей пользователей в памяти процесса
+USER_CACHE_ENABLED = True
+USER_CACHE_SIZE = 10000  # максимальное число профилей
+USER_CACHE_TTL = 300  # время жизни записи, секунд
+
+# Память отрисованных экранов (главное меню, «Моя компания», «Мои заявки»); при WORKERS > 1 не используется
+VIEW_CACHE_ENABLED = True
+VIEW_CACHE_SIZE = 10000  # максимальное число экранов
+VIEW_CACHE_TTL = 300  # время жизни экрана, секунд (изменения из manage.py видны не позже)
+
+# Как долго отчет /report показывается из памяти, прежде чем будет перестроен, секунд
+REPORT_CACHE_TTL = 60
+
+# Лимиты отправки сообщений (сообщений в секунду): общий для бота, для личного чата и для группы
+SEND_WORKERS = 4
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1
+SEND_GROUP_RATE = 20 / 60
+
+# Отправка уведомлений из outbox: размер пачки и интервал опроса таблицы, секунд
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_INTERVAL = 5
+
+# Режим получения обновлений: 'polling' (long polling) или 'webhook' (встроенный aiohttp-сервер)
+RUN_MODE = 'polling'
+WEBHOOK_URL = ''  # публичный адрес, например https://bot.example.com; пустой — вебхук в Telegram не регистрируется
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = ''  # обязателен в режиме webhook (A-Z, a-z, 0-9, _, -), проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_QUEUE_SIZE = 1000  # необработанных обновлений в очереди
+WEBHOOK_WORKERS = 8
+
+# Интервал отложенной записи состояний FSM в базу, секунд
+FSM_FLUSH_INTERVAL = 1
+
+# Число процессов-обработчиков: при значении больше 1 обновления раздаются процессам по Telegram ID пользователя
+WORKERS = 1
+WORKER_LANES = 16  # параллельных очередей пользователей внутри одного процесса
+WORKER_QUEUE_SIZE = 1000  # необработанных обновлений в очереди одного процесса
+
+# Показатели работы: время обработчиков и SQL-запросов; METRICS_PORT = 0 — без HTTP-адреса /metrics
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'  # адрес /metrics доступен только локально
+METRICS_PORT = 0  # в режиме нескольких процессов процесс-обработчик i слушает METRICS_PORT + 1 + i
+METRICS_SLOW_QUERY_MS = 200  # запросы дольше порога записываются в лог
+
+# Перенос завершенных тикетов в архивную таблицу: возраст с момента закрытия, дней (0 — не переносить)
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 500  # тикетов в одной транзакции
+ARCHIVE_INTERVAL = 3600  # между запусками, секунд
+ARCHIVE_PAUSE = 0.1  # между пачками, секунд
+
+# Резервные копии базы: каталог, интервал (секунд, 0 — не делать) и число хранимых снимков
+BACKUP_DIR = 'app/backups'
+BACKUP_INTERVAL = 6 * 3600
+BACKUP_KEEP = 7
+BACKUP_STEP_PAGES = 256  # страниц за один шаг копирования
+BACKUP_STEP_PAUSE = 0.01  # пауза между шагами, секунд
+
+# Локальное хранилище вложений тикетов (фото и документов)
+ATTACHMENTS_DIR = 'app/attachments'
+ATTACHMENTS_STORE = True  # False — хранить только file_id, без копии файлов
@@ -1,13 +1,22 @@
 import asyncio
+import functools
+import inspect
 import logging
 import datetime
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
-from aiogram.filters import Command
+import os
+import tempfile
+import time
+from aiogram import Bot, Dispatcher, types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, FSInputFile
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from app import sql
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendDocument, SendMessage, SendPhoto
+from app import sql, db, archive, attachments, backup, callbacks, export, lifecycle, metrics, outbox, reports, views, webhook, workers
+from app.outbox import OutboxDispatcher
+from app.sender import SendScheduler
+from app.storage import SQLiteStorage
 import config
 
 # Настройка логирования
@@ -15,8 +24,27 @@ logging.basicConfig(level=logging.INFO)
 
 # Создание бота и диспетчера
 bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
+# Состояния FSM хранятся в базе и переживают перезапуск бота
+storage = SQLiteStorage(flush_interval=config.FSM_FLUSH_INTERVAL)
 dp = Dispatcher(storage=storage)
+# Время каждого обработчика попадает в показатели /metrics
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+metrics.register_collector('bot_user_cache', sql.get_user_cache_stats)
+metrics.register_collector('bot_view_memo', views.get_memo_stats)
+# Все исходящие сообщения идут через очередь с учетом лимитов Telegram
+sender = SendScheduler(bot, workers=config.SEND_WORKERS, global_rate=config.SEND_GLOBAL_RATE,
+                       chat_rate=config.SEND_CHAT_RATE, group_rate=config.SEND_GROUP_RATE)
+# Уведомления из таблицы outbox отправляются фоновой задачей и переживают перезапуск
+outbox_dispatcher = OutboxDispatcher(sender, batch_size=config.OUTBOX_BATCH_SIZE, interval=config.OUTBOX_INTERVAL)
+# Давно завершенные тикеты переносятся в архив, чтобы рабочая таблица оставалась небольшой
+archiver = archive.TicketArchiver(config.ARCHIVE_AFTER_DAYS * 86400, batch_size=config.ARCHIVE_BATCH_SIZE,
+                                  interval=config.ARCHIVE_INTERVAL, pause=config.ARCHIVE_PAUSE)
+# Вложения тикетов скачиваются в локальное хранилище в фоне
+attachment_store = attachments.AttachmentStore(bot, config.ATTACHMENTS_DIR)
+# Снимки базы делаются онлайн, без остановки бота
+backup_job = backup.BackupJob(config.BACKUP_DIR, config.BACKUP_INTERVAL, keep=config.BACKUP_KEEP,
+                              step_pages=config.BACKUP_STEP_PAGES, pause=config.BACKUP_STEP_PAUSE)
 
 # Создание таблиц в базе данных SQLite
 sql.create_tables()
@@ -33,9 +61,8 @@ class UserStates(StatesGroup):
 @dp.message(Command("start"))
 async def send_start(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    moscow_dt = sql.parse_to_moscow_naive(message.date)
-    data_reg = moscow_dt.strftime("%Y-%m-%d %H:%M:%S")
-    user = sql.get_user_by_id(user_id)
+    data_reg = sql.to_moscow_text(int(message.date.timestamp()))
+    user = await db.get_user_by_id(user_id)
     
     if not user:
         user_info = {
@@ -49,243 +76,133 @@ async def send_start(message: Message, state: FSMContext):
             'data_ticket': "",
             'user_name': ""
         }
-        sql.add_user(**user_info)
-        text_no_user = "Добро пожаловать в HelpDesk компании <b>ЭниКей</b>! Для работы в сервисе необходимо заполнить данные."
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🏢 Моя компания", callback_data="my_company")]
-        ])
-        await message.answer(text_no_user, reply_markup=keyboard, parse_mode="HTML")
-        await state.set_state(None)
+        await db.add_user(**user_info)
+        await sender.send(message.answer(views.WELCOME_TEXT, reply_markup=views.WELCOME_KEYBOARD, parse_mode="HTML"))
     else:
-        open_ticket = sql.get_ticket_count(user_id, "В работе")
-        closed_ticket = sql.get_ticket_count(user_id, "Завершена")
-        organization = user.get("organization", "Нет данных")
-        organization_phone = user.get("organization_phone", "Нет данных")
-        
-        text_user = (
-            f"<b>🧑‍💻 Главное меню</b>\n\n"
-            f"<b>📋 Компания:</b> {organization}\n"
-            f"<b>☎️ Контактный номер:</b> {organization_phone}\n\n"
-            f"<b>📬 Открытых заявок:</b> {open_ticket}\n"
-            f"<b>📭 Закрытых заявок:</b> {closed_ticket}\n"
-            f"\nВыберите интересующее действие ⬇️"
-        )
-        
-        keyboard_buttons = [
-            [InlineKeyboardButton(text="🏢 Моя компания", callback_data="my_company"),
-             InlineKeyboardButton(text="📥 Мои заявки", callback_data="my_ticket")],
-            [InlineKeyboardButton(text="📤 Новая заявка", callback_data="new_ticket")]
-        ]
-        
-        if user_id in config.ADMIN_USERS:
-            keyboard_buttons.append([InlineKeyboardButton(text="🤘 Тикет меню", callback_data="admin_panel")])
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-        await message.answer(text_user, reply_markup=keyboard, parse_mode="HTML")
-        await state.set_state(None)
-
-def main_menu(tg_id):
-    open_ticket = sql.get_ticket_count(tg_id, "В работе")
-    closed_ticket = sql.get_ticket_count(tg_id, "Завершена")
-    user = sql.get_user_by_id(tg_id)
-    organization = user.get("organization", "Нет данных")
-    organization_phone = user.get("organization_phone", "Нет данных")
-    
-    text = (
-        f"<b>🧑‍💻 Главное меню</b>\n\n"
-        f"<b>📋 Компания:</b> {organization}\n"
-        f"<b>☎️ Контактный номер:</b> {organization_phone}\n\n"
-        f"<b>📬 Открытых заявок:</b> {open_ticket}\n"
-        f"<b>📭 Закрытых заявок:</b> {closed_ticket}\n"
-        f"\nВыберите интересующее действие ⬇️"
-    )
-    
-    keyboard_buttons = [
-        [InlineKeyboardButton(text="🏢 Моя компания", callback_data="my_company"),
-         InlineKeyboardButton(text="📥 Мои заявки", callback_data="my_ticket")],
-        [InlineKeyboardButton(text="📤 Новая заявка", callback_data="new_ticket")]
-    ]
-    
-    if tg_id in config.ADMIN_USERS:
-        keyboard_buttons.append([InlineKeyboardButton(text="🤘 Тикет меню", callback_data="admin_panel")])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    return text, keyboard
-
-def new_ticket(tg_id):
-    text = (
-        f"<b>📤 Создание новой заявки</b>\n\n"
-        f" - 📝 Опишите вашу проблему.\n"
-        f" - 🧩 Пожалуйста, опишите вашу проблему и укажите как можно больше деталей.\n\n"
-        f"<b>Пример оформления заявки:</b>\n<i>Не работает принтер на 4 ПК, необходимо проверить подключение.</i>"
-    )
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-    ])
-    return text, keyboard
-
-def my_ticket(tg_id):
-    user = sql.get_user_by_id(tg_id)
-    user_tickets_in_progress = sql.get_tickets_in_progress_by_user_id(tg_id)
-    total_user_tickets_in_progress = len(user_tickets_in_progress)
-    open_ticket = str(total_user_tickets_in_progress) if total_user_tickets_in_progress else "0"
-    organization = user.get("organization", "Нет данных")
-    organization_address = user.get("organization_adress", "Нет данных")
-    
-    if user_tickets_in_progress:
-        text = (
-            f"<b>📥 Мои заявки в работе</b>\n\n"
-            f"<b>Компания:</b> {organization}\n"
-            f"<b>Адрес заявки:</b> {organization_address}\n"
-            f"<b>Заявок в работе:</b> {open_ticket}\n\n"
-        )
-        for ticket in user_tickets_in_progress:
-            text += (
-                f"<b>Номер заявки:</b> <code>#{ticket[0]}</code>\n"
-                f"<b>Описание:</b> {ticket[4]}\n"
-                f"<b>Дата:</b> {ticket[5]}\n"
-                f"<b>Статус:</b> {ticket[6]}\n"
-            )
-    else:
-        text = (
-            '<b>📥 Мои заявки</b>\n\n'
-            'У вас пока нет заявок в работе.. 🤷‍♂️\n'
-            '- <i>Чтобы оставить заявку, воспользуйтесь меню </i><b>"📤 Новая заявка"</b>'
-        )
+        text, keyboard = await views.main_menu(user_id)
+        await sender.send(message.answer(text, reply_markup=keyboard, parse_mode="HTML"))
+    await state.set_state(None)
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="☑️ История заявок", callback_data="my_ticket_history")],
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-    ])
-    return text, keyboard
-
-def my_ticket_history(tg_id, page=1, page_size=4):
-    completed_tickets = sql.get_completed_tickets_by_user(tg_id)
-    if completed_tickets:
-        if len(completed_tickets) > page_size:
-            start_index = (page - 1) * page_size
-            end_index = start_index + page_size
-            current_page_tickets = completed_tickets[start_index:end_index]
-            text = f"<b>📨 История ваших завершенных заявок (страница {page}):</b>\n\n"
+@dp.message(Command("report"))
+async def send_report(message: Message, command: CommandObject):
+    if message.from_user.id not in config.ADMIN_USERS:
+        return
+    # /report 30 — отчет за последние 30 дней (по умолчанию за неделю)
+    days = int(command.args) if command.args and command.args.strip().isdigit() else 7
+    text = await reports.get_report(min(max(days, 1), 365))
+    await sender.send(message.answer(text, reply_markup=views.COMPLETED_ADMIN_KEYBOARD, parse_mode="HTML"))
+
+# Не больше стольких тикетов за одну команду /close
+CLOSE_MAX_TICKETS = 500
+
+def parse_ticket_numbers(text: str) -> list[int] | None:
+    """Разбирает номера тикетов вида "12 15 #18 20-25"; возвращает None при ошибке или слишком большом списке."""
+    numbers = set()
+    for part in text.replace(',', ' ').split():
+        first, _, last = part.lstrip('#').partition('-')
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start, end = int(first), int(last or first)
+        if end < start or len(numbers) + end - start + 1 > CLOSE_MAX_TICKETS:
+            return None
+        numbers.update(range(start, end + 1))
+    return sorted(numbers)
+
+@dp.message(Command("close"))
+async def send_close(message: Message, command: CommandObject):
+    if message.from_user.id not in config.ADMIN_USERS:
+        return
+    numbers = parse_ticket_numbers(command.args or "")
+    if not numbers:
+        await sender.send(message.answer(
+            f"Укажите номера заявок (не больше {CLOSE_MAX_TICKETS}).\nПример: <code>/close 12 15 20-25</code>",
+            parse_mode="HTML"))
+        return
+    # Все заявки закрываются одной транзакцией; уже закрытые и несуществующие пропускаются
+    changes = await lifecycle.close_tickets(numbers, message.from_user.id, completion_notifications)
+    if changes:
+        outbox_dispatcher.wake()
+    closed = [change.number for change in changes]
+    skipped = sorted(set(numbers) - set(closed))
+    text = f"<b>✅ Закрыто заявок:</b> {len(closed)}\n"
+    if closed:
+        text += " ".join(f"#{number}" for number in closed[:100]) + (" …" if len(closed) > 100 else "") + "\n"
+    if skipped:
+        text += f"\n<b>Пропущено</b> (уже закрыты или не найдены): {len(skipped)}\n"
+        text += " ".join(f"#{number}" for number in skipped[:100]) + (" …" if len(skipped) > 100 else "") + "\n"
+    await sender.send(message.answer(text, reply_markup=views.COMPLETED_ADMIN_KEYBOARD, parse_mode="HTML"))
+
+# Статусы для фильтра /export и ограничение Bot API на размер отправляемого файла
+EXPORT_STATUSES = {'open': "В работе", 'closed': "Завершена"}
+EXPORT_MAX_SIZE = 50 * 1024 * 1024
+
+@dp.message(Command("export"))
+async def send_export(message: Message, command: CommandObject):
+    if message.from_user.id not in config.ADMIN_USERS:
+        return
+    # /export [tickets|users] [csv|jsonl] [open|closed] [YYYY-MM-DD [YYYY-MM-DD]]: первая дата — начало периода,
+    # вторая — его последний день (включительно)
+    table, fmt, status, days = 'ticket', 'csv', None, []
+    for arg in (command.args or "").split():
+        if arg in ('tickets', 'users'):
+            table = 'ticket' if arg == 'tickets' else 'users'
+        elif arg in export.FORMATS:
+            fmt = arg
+        elif arg in EXPORT_STATUSES:
+            status = EXPORT_STATUSES[arg]
         else:
-            current_page_tickets = completed_tickets
-            text = "<b>📨 История ваших завершенных заявок:</b>\n\n"
-        
-        for ticket in current_page_tickets:
-            text += (
-                f"✅\n"
-                f"<b>├ Номер заявки:</b> <code>#{ticket[0]}</code>\n"
-                f"<b>├ Время создания:</b> {ticket[5]}\n"
-                f"<b>├ Сообщение:</b> - <em>{ticket[4]}</em>\n"
-                f"<b>└ Комментарий исполнителя:</b> - <em>{ticket[7]}</em>\n\n"
-            )
-    else:
-        text = "🤷‍♂️ Упс.. У вас нет истории заявок."
-        
-    keyboard_buttons = []
-    if len(completed_tickets) > page_size:
-        nav_buttons = []
-        if page > 1:
-            nav_buttons.append(InlineKeyboardButton(text="🔙 Предыдущая", callback_data=f"my_ticket_page_{page - 1}"))
-        if end_index < len(completed_tickets):
-            nav_buttons.append(InlineKeyboardButton(text="🔜 Следующая", callback_data=f"my_ticket_page_{page + 1}"))
-        if nav_buttons:
-            keyboard_buttons.append(nav_buttons)
-    
-    keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="my_ticket")])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    return text, keyboard
+            days.append(arg)
+    try:
+        if len(days) > 2:
+            raise ValueError(f"Лишний аргумент: {days[2]}")
+        since = export.parse_day(days[0]) if len(days) > 0 else None
+        until = export.parse_day_end(days[1]) if len(days) > 1 else None
+        if status is not None and table == 'users':
+            raise ValueError("Фильтр по статусу доступен только для заявок")
+    except ValueError as error:
+        await sender.send(message.answer(f"Ошибка: {error}.\nПример: <code>/export tickets closed 2024-01-01 2024-01-31</code>", parse_mode="HTML"))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = f"{table}_{sql.to_moscow_text(int(time.time()))[:10]}.{fmt}.gz"
+        path = os.path.join(directory, filename)
+        count = await db.run(export.export_table, path, table, fmt, since, until, status)
+        if os.path.getsize(path) > EXPORT_MAX_SIZE:
+            await sender.send(message.answer("Файл выгрузки больше 50 МБ. Сузьте период или воспользуйтесь <code>manage.py export</code>.", parse_mode="HTML"))
+            return
+        await sender.send(SendDocument(chat_id=message.chat.id, document=FSInputFile(path, filename),
+                                       caption=f"Выгружено строк: {count}"))
+
+@dp.message(Command("search"))
+async def send_search(message: Message, command: CommandObject, state: FSMContext):
+    if message.from_user.id not in config.ADMIN_USERS:
+        return
+    query = (command.args or "").strip()
+    if not query:
+        await sender.send(message.answer("Укажите, что искать.\nПример: <code>/search принтер</code>", parse_mode="HTML"))
+        return
+    # Запрос не помещается в callback_data, поэтому для листания страниц он хранится в данных FSM
+    await state.update_data(search_query=query)
+    text, keyboard = await views.search_results(query)
+    await sender.send(message.answer(text, reply_markup=keyboard, parse_mode="HTML"))
+
+# Нажатия на кнопки разбираются таблицей действий (app/callbacks.py), а не цепочкой фильтров
+callback_router = callbacks.CallbackRouter()
 
-def my_company(tg_id):
-    user = sql.get_user_by_id(tg_id)
-    organization = user.get("organization", "Нет данных")
-    organization_address = user.get("organization_adress", "Нет данных")
-    organization_inn = user.get("organization_inn", "Нет данных")
-    organization_phone = user.get("organization_phone", "Нет данных")
-    
-    text = (
-        f"<b>🏢 Информация о компании</b>\n\n"
-        f"<b>📋 Компания:</b> {organization}\n"
-        f"<b>📍 Адрес:</b> {organization_address}\n"
-        f"<b>📑 ИНН:</b> {organization_inn}\n"
-        f"<b>☎️ Контактный номер:</b> <i>{organization_phone}</i>\n\n"
-        f"<b>ЗАПОЛНИТЬ ДАННЫЕ О КОМПАНИИ ⬇️</b>"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"{'✅' if organization != 'Нет данных' else '❌'} Наименование компании", callback_data="edit_company_name")],
-        [InlineKeyboardButton(text=f"{'✅' if organization_address != 'Нет данных' else '❌'} Фактический адрес", callback_data="edit_company_adress")],
-        [InlineKeyboardButton(text=f"{'✅' if organization_inn != 'Нет данных' else '❌'} ИНН", callback_data="edit_company_inn")],
-        [InlineKeyboardButton(text=f"{'✅' if organization_phone != 'Нет данных' else '❌'} Контактный номер", callback_data="edit_company_phone")],
-        [InlineKeyboardButton(text="⬅️ В меню", callback_data="main_menu")]
-    ])
-    return text, keyboard
-
-def edit_company_name(tg_id):
-    text = f"📋 Введите наименование организации.\nПример: <code>ООО РОГА И КОПЫТА</code>"
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="my_company")]
-    ])
-    return text, keyboard
-
-def edit_company_address(tg_id):
-    text = f"📍 Введите фактический адрес организации.\nПример: <code>г. Иваново, ул. Варенцовой, д. 33 оф. 1</code>"
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="my_company")]
-    ])
-    return text, keyboard
-
-def edit_company_inn(tg_id):
-    text = f"📑 Введите ИНН организации.\nПример: <code>3700010101</code>"
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="my_company")]
-    ])
-    return text, keyboard
-
-def edit_company_phone(tg_id):
-    text = f"☎️ Введите контактный номер телефона.\nПример: <code>+79109998188</code>"
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="my_company")]
-    ])
-    return text, keyboard
-
-def done_ticket(tg_id):
-    last_ticket_number = sql.get_last_ticket_number()
-    text = (
-        f'🎉🥳 Успех, ваша заявка зарегистрирована!\n\n'
-        f'<b>Номер заявки:</b> <code>#{last_ticket_number}</code>.\n\n'
-        f'<i>PS: Отслеживайте статус поставленных задач в разделе</i> <b>"📥 Мои заявки"</b>'
-    )
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🧑‍💻 Главное меню", callback_data="main_menu")]
-    ])
-    return text, keyboard
-
-def admin_panel():
-    total_open_tickets = sql.get_ticket_count(None, "В работе")
-    total_closed_tickets = sql.get_ticket_count(None, "Завершена")
-    all_tickets_in_progress = sql.get_all_tickets_in_progress()
-    
-    text = (
-        f"<b>🤘 Тикет меню 💲</b>\n\n"
-        f"<b>🔥 Заявок в работе:</b> {total_open_tickets}\n"
-        f"<b>👍 Завершенных заявок:</b> {total_closed_tickets}\n\n"
-        f"<b>⚠️ Внимание!</b> <i>Закрытые задачи не могут быть возвращены в работу. Пожалуйста, будьте внимательны при их закрытии!</i>"
-    )
-    
-    keyboard_buttons = []
-    for ticket in all_tickets_in_progress:
-        ticket_info = f"Заявка #{ticket[0]} - {ticket[5]}"
-        keyboard_buttons.append([InlineKeyboardButton(text=ticket_info, callback_data=f"ticket_{ticket[0]}")])
-    keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    return text, keyboard
-
-@dp.callback_query(F.data.startswith('ticket_'))
-async def handle_ticket_callback(query: CallbackQuery, state: FSMContext):
-    user_id = query.from_user.id
-    ticket_id = int(query.data.split('_')[1])
-    ticket_info = sql.get_ticket_info(ticket_id)
+@dp.callback_query()
+async def handle_callback(query: CallbackQuery, state: FSMContext):
+    await callback_router.dispatch(query, state)
+
+def attachment_method(chat_id, kind, file, caption):
+    """Запрос отправки вложения: file — file_id или локальный файл."""
+    if kind == 'photo':
+        return SendPhoto(chat_id=chat_id, photo=file, caption=caption)
+    return SendDocument(chat_id=chat_id, document=file, caption=caption)
+
+@callback_router.callback(callbacks.TicketCallback)
+async def handle_ticket_callback(query: CallbackQuery, state: FSMContext, callback_data: callbacks.TicketCallback):
+    ticket_id = callback_data.id
+    ticket_info = await db.get_ticket_info(ticket_id)
     await state.set_state(UserStates.waiting_for_ticket_comment)
     await state.update_data(ticket_id=ticket_id)
     
@@ -297,185 +214,200 @@ async def handle_ticket_callback(query: CallbackQuery, state: FSMContext):
         f"<b>Сообщение от пользователя:</b> - <em>{ticket_info[4]}</em>\n\n"
         f"<b>Время создания:</b> {ticket_info[5]}\n"
         f"<b>Статус:</b> {ticket_info[6]}\n\n"
-        f"<em>⚠️ Для завершения задачи введите комментарий. В ответ вам придет сообщение с подтвержением!</em>"
     )
+    text += views.ticket_events(await db.get_ticket_events(ticket_id))
+    files = await db.get_ticket_attachments(ticket_id)
+    if files:
+        text += f"<b>📎 Вложений:</b> {len(files)}\n\n"
+    text += f"<em>⚠️ Для завершения задачи введите комментарий. В ответ вам придет сообщение с подтвержением!</em>"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel")]
-    ])
-    await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await sender.send(query.message.edit_text(text, reply_markup=views.BACK_TO_ADMIN_PANEL_KEYBOARD, parse_mode="HTML"))
+    await query.answer()
+    for _, kind, file_id, _, file_name, stored_path in files:
+        caption = f"Вложение к заявке #{ticket_id}"
+        try:
+            # Файл уже есть на серверах Telegram — отправка по file_id ничего не загружает заново
+            await sender.send(attachment_method(query.from_user.id, kind, file_id, caption))
+        except TelegramBadRequest:
+            if stored_path is None or not os.path.exists(stored_path):
+                logging.warning("Вложение заявки %s недоступно: %s", ticket_id, file_id)
+                continue
+            await sender.send(attachment_method(query.from_user.id, kind, FSInputFile(stored_path, file_name), caption))
+
+@callback_router.callback(callbacks.HistoryPageCallback)
+async def handle_ticket_page_callback(query: CallbackQuery, state: FSMContext, callback_data: callbacks.HistoryPageCallback):
+    await query.answer()
+    text, keyboard = await views.my_ticket_history(query.from_user.id, callback_data.page, callback_data.after, callback_data.before)
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
+
+@callback_router.callback(callbacks.AdminPageCallback)
+async def handle_admin_page_callback(query: CallbackQuery, state: FSMContext, callback_data: callbacks.AdminPageCallback):
+    data = await state.get_data()
     await query.answer()
+    text, keyboard = await views.admin_panel(data.get('admin_org'), data.get('admin_newest', False), callback_data.page,
+                                             callback_data.after, callback_data.before)
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
 
-@dp.callback_query(F.data.startswith('my_ticket_page_'))
-async def handle_ticket_page_callback(query: CallbackQuery):
-    page = int(query.data.split('_')[3])
+@callback_router.callback(callbacks.SearchPageCallback)
+async def handle_search_page_callback(query: CallbackQuery, state: FSMContext, callback_data: callbacks.SearchPageCallback):
+    data = await state.get_data()
     await query.answer()
-    text, keyboard = my_ticket_history(query.from_user.id, page)
-    await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    if not data.get('search_query'):
+        return
+    text, keyboard = await views.search_results(data['search_query'], callback_data.page)
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
+
+@callback_router.callback(callbacks.AdminOrgCallback)
+async def handle_admin_org_callback(query: CallbackQuery, state: FSMContext, callback_data: callbacks.AdminOrgCallback):
+    # Названия организаций не помещаются в callback_data, поэтому кнопка хранит индекс
+    # в списке, который был показан администратору в фильтре
+    index = callback_data.index
+    data = await state.get_data()
+    organizations = data.get('admin_org_list', [])
+    organization = organizations[index] if index is not None and 0 <= index < len(organizations) else None
+    await state.update_data(admin_org=organization)
+    await query.answer()
+    text, keyboard = await views.admin_panel(organization, data.get('admin_newest', False))
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
 
-@dp.callback_query()
-async def inline_kb_answer_callback_handler(query: CallbackQuery, state: FSMContext):
-    user_id = query.from_user.id
-    
-    if query.data == 'admin_panel':
-        await state.set_state(None)
-        await query.answer()
-        text, keyboard = admin_panel()
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-
-    elif query.data == 'main_menu':
-        await state.set_state(None)
-        await query.answer()
-        text, keyboard = main_menu(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data.startswith('complete_'):
-        ticket_id = int(query.data.split('_')[1])
-        await query.answer()
-        sql.update_ticket_status(ticket_id, "Завершена")
-        ticket_comm_done = sql.read_ticket_comment(ticket_id)
-        ticket_info = sql.get_ticket_info(ticket_id)
-        
-        current_time = sql.parse_to_moscow_naive(None)
-        time_ticket = sql.parse_to_moscow_naive(ticket_info[5])  
-        time_difference = current_time - time_ticket
-        hours = int(time_difference.total_seconds() // 3600)
-
-        user_id = ticket_info[1]
-        completion_message = (
-            f"🎉 Задача <code>#{ticket_id}</code> выполнена!\n"
-            f"<b>Время выполнения:</b> {hours} часа(ов).\n\n"
-            f"<b>Ответ исполнителя:</b> - <em>{ticket_comm_done}</em>\n\n"
-            f"<em>⚠️ Пожалуйста, проверьте корректность исполнения задачи.</em>"
-        )
-        
-        keyboard_markup_user = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="☑️ История заявок", callback_data="my_ticket_history"),
-            InlineKeyboardButton(text="🧑‍💻 Главное меню", callback_data="main_menu")]
-        ])
-        
-        keyboard_markup_admin = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🤘 Тикет меню", callback_data="admin_panel")]
-        ])
-        
-        await bot.send_message(user_id, completion_message, reply_markup=keyboard_markup_user, parse_mode="HTML")
-        await bot.send_message(query.from_user.id, completion_message, reply_markup=keyboard_markup_admin, parse_mode="HTML")
-        await state.set_state(None)
-        
-    elif query.data == 'my_company':
-        await state.set_state(None)
-        await query.answer()
-        text, keyboard = my_company(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-       
-    elif query.data == 'edit_company_name':
-        await state.set_state(UserStates.waiting_for_company_name)
-        await query.answer()
-        text, keyboard = edit_company_name(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data == 'edit_company_adress':
-        await state.set_state(UserStates.waiting_for_company_address)
-        await query.answer()
-        text, keyboard = edit_company_address(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data == 'edit_company_inn':
-        await state.set_state(UserStates.waiting_for_company_inn)
-        await query.answer()
-        text, keyboard = edit_company_inn(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data == 'edit_company_phone':
-        await state.set_state(UserStates.waiting_for_company_phone)
-        await query.answer()
-        text, keyboard = edit_company_phone(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data == 'new_ticket':
-        await state.set_state(UserStates.waiting_for_ticket_message)
-        await query.answer()
-        text, keyboard = new_ticket(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data == 'my_ticket':
-        await state.set_state(None)
-        await query.answer()
-        text, keyboard = my_ticket(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
-        
-    elif query.data == 'my_ticket_history':
-        await state.set_state(None)
-        await query.answer()
-        text, keyboard = my_ticket_history(user_id)
-        await query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+@callback_router.action('admin_panel')
+async def handle_admin_panel(query: CallbackQuery, state: FSMContext):
+    await state.set_state(None)
+    await query.answer()
+    data = await state.get_data()
+    text, keyboard = await views.admin_panel(data.get('admin_org'), data.get('admin_newest', False))
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
+
+@callback_router.action('admin_sort')
+async def handle_admin_sort(query: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    newest_first = not data.get('admin_newest', False)
+    await state.update_data(admin_newest=newest_first)
+    await query.answer()
+    text, keyboard = await views.admin_panel(data.get('admin_org'), newest_first)
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
+
+@callback_router.action('admin_filter')
+async def handle_admin_filter(query: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await query.answer()
+    text, keyboard, organizations = await views.admin_filter(data.get('admin_org'))
+    await state.update_data(admin_org_list=organizations)
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
+
+def completion_notifications(changes: list[lifecycle.TicketChange]) -> list[sql.Notification]:
+    """Уведомления владельцам о завершении тикетов; записываются в outbox вместе со сменой статуса."""
+    return [outbox.notification(SendMessage(chat_id=change.tg_id, text=views.ticket_completed(change),
+                                            reply_markup=views.COMPLETED_USER_KEYBOARD, parse_mode="HTML"))
+            for change in changes]
+
+@callback_router.callback(callbacks.CompleteCallback)
+async def handle_complete_callback(query: CallbackQuery, state: FSMContext, callback_data: callbacks.CompleteCallback):
+    # Статус, журнал событий и уведомление пользователю — один запрос в одной транзакции
+    change = await lifecycle.close_ticket(callback_data.id, query.from_user.id, completion_notifications)
+    await state.set_state(None)
+    if change is None:
+        await query.answer("Заявка уже завершена.")
+        return
+    await query.answer()
+    outbox_dispatcher.wake()
+    await sender.send(SendMessage(chat_id=query.from_user.id, text=views.ticket_completed(change),
+                                  reply_markup=views.COMPLETED_ADMIN_KEYBOARD, parse_mode="HTML"))
+
+async def show_screen(query: CallbackQuery, state: FSMContext, new_state: State | None, view) -> None:
+    """Переводит пользователя в состояние new_state и показывает экран view(tg_id) вместо текущего сообщения."""
+    await state.set_state(new_state)
+    await query.answer()
+    screen = view(query.from_user.id)
+    text, keyboard = await screen if inspect.isawaitable(screen) else screen
+    await sender.send(query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML"))
+
+# Кнопки, которые только меняют состояние FSM и показывают экран пользователя
+for action, new_state, view in (
+    ('main_menu', None, views.main_menu),
+    ('my_company', None, views.my_company),
+    ('edit_company_name', UserStates.waiting_for_company_name, views.edit_company_name),
+    ('edit_company_adress', UserStates.waiting_for_company_address, views.edit_company_address),
+    ('edit_company_inn', UserStates.waiting_for_company_inn, views.edit_company_inn),
+    ('edit_company_phone', UserStates.waiting_for_company_phone, views.edit_company_phone),
+    ('new_ticket', UserStates.waiting_for_ticket_message, views.new_ticket),
+    ('my_ticket', None, views.my_ticket),
+    ('my_ticket_history', None, views.my_ticket_history),
+):
+    callback_router.action(action)(functools.partial(show_screen, new_state=new_state, view=view))
 
 @dp.message(UserStates.waiting_for_company_name)
 async def handle_company_name(message: Message, state: FSMContext):
-    sql.update_user_field(message.from_user.id, 'organization', message.text)
-    text, keyboard = my_company(message.from_user.id)
-    await message.reply(text, reply_markup=keyboard, parse_mode="HTML")
+    await db.update_user_field(message.from_user.id, 'organization', message.text)
+    text, keyboard = await views.my_company(message.from_user.id)
+    await sender.send(message.reply(text, reply_markup=keyboard, parse_mode="HTML"))
     await state.set_state(None)
 
 @dp.message(UserStates.waiting_for_company_address)
 async def handle_company_address(message: Message, state: FSMContext):
-    sql.update_user_field(message.from_user.id, 'organization_adress', message.text)
-    text, keyboard = my_company(message.from_user.id)
-    await message.reply(text, reply_markup=keyboard, parse_mode="HTML")
+    await db.update_user_field(message.from_user.id, 'organization_adress', message.text)
+    text, keyboard = await views.my_company(message.from_user.id)
+    await sender.send(message.reply(text, reply_markup=keyboard, parse_mode="HTML"))
     await state.set_state(None)
 
 @dp.message(UserStates.waiting_for_company_inn)
 async def handle_company_inn(message: Message, state: FSMContext):
-    sql.update_user_field(message.from_user.id, 'organization_inn', message.text)
-    text, keyboard = my_company(message.from_user.id)
-    await message.reply(text, reply_markup=keyboard, parse_mode="HTML")
+    await db.update_user_field(message.from_user.id, 'organization_inn', message.text)
+    text, keyboard = await views.my_company(message.from_user.id)
+    await sender.send(message.reply(text, reply_markup=keyboard, parse_mode="HTML"))
     await state.set_state(None)
 
 @dp.message(UserStates.waiting_for_company_phone)
 async def handle_company_phone(message: Message, state: FSMContext):
-    sql.update_user_field(message.from_user.id, 'organization_phone', message.text)
-    text, keyboard = my_company(message.from_user.id)
-    await message.reply(text, reply_markup=keyboard, parse_mode="HTML")
+    await db.update_user_field(message.from_user.id, 'organization_phone', message.text)
+    text, keyboard = await views.my_company(message.from_user.id)
+    await sender.send(message.reply(text, reply_markup=keyboard, parse_mode="HTML"))
     await state.set_state(None)
 
 @dp.message(UserStates.waiting_for_ticket_message)
 async def handle_ticket_message(message: Message, state: FSMContext):
     user_id = message.from_user.id
     username = message.from_user.username
-    user = sql.get_user_by_id(user_id)
+    user = await db.get_user_by_id(user_id)
     organization = user.get("organization", "Нет данных")
     addres_ticket = user.get("organization_adress", "Нет данных")
     organization_phone = user.get("organization_phone", "Нет данных")
-    message_ticket = message.text
-    time_ticket_dt = sql.parse_to_moscow_naive(message.date)
-    time_ticket = time_ticket_dt.strftime("%Y-%m-%d %H:%M:%S")
-    state_ticket = "В работе"
-    ticket_comm = ""
-
-    sql.add_ticket(user_id, organization, addres_ticket, message_ticket, time_ticket, state_ticket, ticket_comm)
-    last_ticket_number = sql.get_last_ticket_number()
-
-    if last_ticket_number:
-        sql.update_user_field(user_id, 'history_ticket', str(last_ticket_number))
-        sql.update_user_field(user_id, 'data_ticket', time_ticket)
-        sql.update_user_field(user_id, 'user_name', username)
-        
-        text, keyboard = done_ticket(user_id)
-        await message.reply(text, reply_markup=keyboard, parse_mode="HTML")
-        
+    files = attachments.from_message(message)
+    # У фото и документов описание приходит в подписи
+    message_ticket = message.text or message.caption or ("📎 Вложение" if files else None)
+    if message_ticket is None:
+        await sender.send(message.reply("Опишите проблему текстом или приложите скриншот или документ."))
+        return
+    time_ticket = sql.to_moscow_text(int(message.date.timestamp()))
+
+    def admin_notifications(ticket_id):
         admin_text = (
-            f"📬❗️\nПользователь @{username} создал новую заявку с номером <code>#{last_ticket_number}</code>.\n\n"
+            f"📬❗️\nПользователь @{username} создал новую заявку с номером <code>#{ticket_id}</code>.\n\n"
             f"<b>Сообщение от пользователя:</b>\n - <em>{message_ticket}</em>\n\n"
             f"<b>Телефон:</b> {organization_phone}\n"
             f"<b>Компания:</b> {organization}\n"
             f"<b>Адрес:</b> {addres_ticket}\n"
         )
-        keyboard_markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🤘 Тикет меню 🫰", callback_data="admin_panel")]
-        ])
-        await bot.send_message(config.ADMIN_MESSAGE, admin_text, parse_mode="HTML", reply_markup=keyboard_markup)
+        if files:
+            admin_text += f"<b>Вложений:</b> {len(files)}\n"
+        return [outbox.notification(SendMessage(chat_id=config.ADMIN_MESSAGE, text=admin_text, parse_mode="HTML",
+                                                reply_markup=views.NEW_TICKET_ADMIN_KEYBOARD))] + [
+            outbox.notification(attachment_method(config.ADMIN_MESSAGE, kind, file_id, f"Вложение к заявке #{ticket_id}"))
+            for kind, file_id, *_ in files
+        ]
+
+    # Уведомление администратору попадает в outbox в одной транзакции с тикетом
+    ticket_id = await db.create_ticket(user_id, organization, addres_ticket, message_ticket, time_ticket, username,
+                                       notifications=admin_notifications, attachments=files)
+
+    if ticket_id:
+        outbox_dispatcher.wake()
+        if files:
+            attachment_store.wake()
+        text, keyboard = views.done_ticket(ticket_id)
+        await sender.send(message.reply(text, reply_markup=keyboard, parse_mode="HTML"))
     else:
-        await message.reply("Ошибка при получении заявки.")
+        await sender.send(message.reply("Ошибка при получении заявки."))
     await state.set_state(None)
 
 @dp.message(UserStates.waiting_for_ticket_comment)
@@ -486,7 +418,7 @@ async def handle_ticket_comment(message: Message, state: FSMContext):
     
     if ticket_id:
         comment_text = message.text
-        sql.update_ticket_comment(ticket_id, comment_text)
+        await db.update_ticket_comment(ticket_id, comment_text)
         
         success_message = (
             f"<b>Комментарий к тикету <code>#{ticket_id}</code> успешно записан!</b>\n\n"
@@ -494,15 +426,97 @@ async def handle_ticket_comment(message: Message, state: FSMContext):
             f"<em>⚠️ Если вы допустили ошибку, просто отправьте исправленное сообщение еще раз.</em>"
         )
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Завершить задачу", callback_data=f"complete_{ticket_id}")]
+            [InlineKeyboardButton(text="✅ Завершить задачу", callback_data=callbacks.CompleteCallback(id=ticket_id).pack())]
         ])
-        await message.reply(success_message, reply_markup=keyboard, parse_mode="HTML")
+        await sender.send(message.reply(success_message, reply_markup=keyboard, parse_mode="HTML"))
     else:
-        await message.reply("Ошибка: не указан номер тикета.", parse_mode="HTML")
+        await sender.send(message.reply("Ошибка: не указан номер тикета.", parse_mode="HTML"))
     # Состояние не сбрасываем, чтобы пользователь мог отправить новый комментарий
 
+async def start_metrics(port):
+    """Запускает HTTP-адрес /metrics, если он включен в настройках; иначе возвращает None."""
+    if not (config.METRICS_ENABLED and config.METRICS_PORT):
+        return None
+    return await metrics.start_server(config.METRICS_HOST, port)
+
+def start_background_tasks() -> list[asyncio.Task]:
+    """Запускает фоновые задачи процесса, который принимает обновления: outbox, архив, резервные копии и вложения."""
+    tasks = [asyncio.create_task(outbox_dispatcher.run())]
+    if config.ARCHIVE_AFTER_DAYS:
+        tasks.append(asyncio.create_task(archiver.run()))
+    if config.BACKUP_INTERVAL:
+        tasks.append(asyncio.create_task(backup_job.run()))
+    if config.ATTACHMENTS_STORE:
+        tasks.append(asyncio.create_task(attachment_store.run()))
+    return tasks
+
+async def worker_main(index, queue):
+    metrics_runner = await start_metrics(config.METRICS_PORT + 1 + index)
+    try:
+        await workers.serve(bot, dp, queue, config.WORKER_LANES)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await sender.stop()
+        await storage.close()
+        await bot.session.close()
+        await db.close()
+
+def worker_process(index, count, queue):
+    """Точка входа процесса-обработчика: общий лимит отправки делится поровну между всеми процессами."""
+    sender.set_global_rate(config.SEND_GLOBAL_RATE / (count + 1))
+    asyncio.run(worker_main(index, queue))
+
+async def run_supervisor():
+    supervisor = workers.Supervisor(worker_process, config.WORKERS, config.WORKER_QUEUE_SIZE)
+    supervisor.start()
+    # Основной процесс отправляет уведомления из outbox и получает свою долю общего лимита
+    sender.set_global_rate(config.SEND_GLOBAL_RATE / (config.WORKERS + 1))
+    metrics_runner = await start_metrics(config.METRICS_PORT)
+    # Уведомления создаются в других процессах, поэтому outbox опрашивается чаще
+    outbox_dispatcher.interval = min(outbox_dispatcher.interval, 1)
+    background_tasks = start_background_tasks()
+    try:
+        if config.RUN_MODE == 'webhook':
+            await webhook.run(bot, supervisor.route, config.WEBHOOK_URL, config.WEBHOOK_PATH, config.WEBHOOK_SECRET,
+                              config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_QUEUE_SIZE,
+                              config.WEBHOOK_WORKERS, dp.resolve_used_update_types())
+        else:
+            await bot.delete_webhook()
+            await supervisor.poll(bot, dp.resolve_used_update_types())
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await supervisor.stop()
+        await sender.stop()
+        await bot.session.close()
+        await db.close()
+
 async def main():
-    await dp.start_polling(bot)
+    if config.WORKERS > 1:
+        await run_supervisor()
+        return
+    metrics_runner = await start_metrics(config.METRICS_PORT)
+    background_tasks = start_background_tasks()
+    try:
+        if config.RUN_MODE == 'webhook':
+            await webhook.run(bot, functools.partial(dp.feed_raw_update, bot), config.WEBHOOK_URL,
+                              config.WEBHOOK_PATH, config.WEBHOOK_SECRET, config.WEBHOOK_HOST, config.WEBHOOK_PORT,
+                              config.WEBHOOK_QUEUE_SIZE, config.WEBHOOK_WORKERS, dp.resolve_used_update_types())
+        else:
+            # После работы в режиме вебхука getUpdates вернул бы ошибку конфликта
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await sender.stop()
+        await storage.close()
+        await db.close()
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
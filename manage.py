@@ -0,0 +1,101 @@
+import argparse
+import logging
+
+from app import archive, backup, export, sql
+import config
+
+def counters(args: argparse.Namespace) -> None:
+    """Проверяет счетчики тикетов и при необходимости пересчитывает их."""
+    drift = sql.verify_ticket_counters()
+    for tg_id, state_ticket, stored, actual in drift:
+        print(f"tg_id={tg_id} {state_ticket!r}: в счетчике {stored}, фактически {actual}")
+    if not drift:
+        print("Счетчики совпадают с таблицей ticket.")
+    elif args.action == 'rebuild':
+        sql.rebuild_ticket_counters()
+        print(f"Счетчики пересчитаны, исправлено расхождений: {len(drift)}.")
+
+def search(args: argparse.Namespace) -> None:
+    """Перестраивает полнотекстовый индекс тикетов."""
+    sql.rebuild_search_index()
+    print("Поисковый индекс перестроен.")
+
+def archive_command(args: argparse.Namespace) -> None:
+    """Переносит давно завершенные тикеты в архивную таблицу."""
+    moved = archive.archive_now(args.days * 86400, args.batch_size, config.ARCHIVE_PAUSE)
+    print(f"Перенесено в архив тикетов: {moved}.")
+
+def backup_command(args: argparse.Namespace) -> None:
+    """Делает резервную копию базы."""
+    path = backup.create_backup(args.dir, args.keep, config.BACKUP_STEP_PAGES, config.BACKUP_STEP_PAUSE)
+    print(f"Резервная копия: {path}")
+
+def restore_command(args: argparse.Namespace) -> None:
+    """Восстанавливает базу из резервной копии."""
+    if not args.force:
+        raise SystemExit("Остановите бота и повторите команду с --force: текущая база будет заменена.")
+    # Соединения с заменяемой базой нужно закрыть до переноса файлов
+    sql.close_connections()
+    saved = backup.restore_backup(args.file)
+    print(f"База восстановлена из {args.file}." + (f" Прежняя база сохранена в {saved}." if saved else ""))
+
+def export_command(args: argparse.Namespace) -> None:
+    """Выгружает таблицу в файл CSV или JSON Lines."""
+    if args.status is not None and sql.EXPORT_TABLES[args.table][1] is None:
+        raise SystemExit(f"Фильтр --status не поддерживается для таблицы {args.table}")
+    since = export.parse_day(args.since) if args.since else None
+    until = export.parse_day(args.until) if args.until else None
+    count = export.export_table(args.output, args.table, args.format, since, until, args.status,
+                                compress=True if args.gzip else None)
+    print(f"Выгружено строк: {count} -> {args.output}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Служебные команды бота")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    counters_parser = subparsers.add_parser('counters', help="проверка и пересчет счетчиков тикетов")
+    counters_parser.add_argument('action', choices=['verify', 'rebuild'])
+    counters_parser.set_defaults(handler=counters)
+
+    search_parser = subparsers.add_parser('search', help="обслуживание полнотекстового индекса тикетов")
+    search_parser.add_argument('action', choices=['rebuild'])
+    search_parser.set_defaults(handler=search)
+
+    export_parser = subparsers.add_parser('export', help="выгрузка тикетов или пользователей в CSV/JSON Lines")
+    export_parser.add_argument('table', choices=list(sql.EXPORT_TABLES))
+    export_parser.add_argument('output', help="путь к файлу; окончание .gz включает сжатие")
+    export_parser.add_argument('--format', choices=export.FORMATS, default='csv')
+    export_parser.add_argument('--since', help="дата создания от (YYYY-MM-DD, включительно)")
+    export_parser.add_argument('--until', help="дата создания до (YYYY-MM-DD, не включительно)")
+    export_parser.add_argument('--status', help="статус тикета, например \"Завершена\"")
+    export_parser.add_argument('--gzip', action='store_true', help="сжать файл независимо от расширения")
+    export_parser.set_defaults(handler=export_command)
+
+    archive_parser = subparsers.add_parser('archive', help="перенос давно завершенных тикетов в архив")
+    archive_parser.add_argument('--days', type=int, default=config.ARCHIVE_AFTER_DAYS,
+                                help="возраст с момента закрытия, дней")
+    archive_parser.add_argument('--batch-size', type=int, default=config.ARCHIVE_BATCH_SIZE)
+    archive_parser.set_defaults(handler=archive_command)
+
+    backup_parser = subparsers.add_parser('backup', help="резервная копия базы без остановки бота")
+    backup_parser.add_argument('--dir', default=config.BACKUP_DIR)
+    backup_parser.add_argument('--keep', type=int, default=config.BACKUP_KEEP, help="сколько снимков хранить")
+    backup_parser.set_defaults(handler=backup_command)
+
+    restore_parser = subparsers.add_parser('restore', help="восстановление базы из резервной копии")
+    restore_parser.add_argument('file', help="снимок .db.gz")
+    restore_parser.add_argument('--force', action='store_true', help="подтверждение замены текущей базы")
+    # Восстанавливают чаще всего поврежденную базу, поэтому миграции к ней не применяются
+    restore_parser.set_defaults(handler=restore_command, migrate=False)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if getattr(args, 'migrate', True):
+        sql.create_tables()
+    try:
+        args.handler(args)
+    finally:
+        sql.close_connections()
+
+if __name__ == '__main__':
+    main()